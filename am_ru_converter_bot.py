@@ -2,10 +2,17 @@ from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
 from dotenv import load_dotenv
 import logging
 import os
+import threading
+import time
 from os.path import join, dirname
 
 from googletrans import Translator
 from converter import ARConverter
+from bot_pipeline import AsyncPipeline
+from message_cache import MessageCache
+from scheduler import ChatScheduler
+from translation import GoogleTranslator, TranslationCache, CachedTranslator
+from webhook import TelegramClient, WebhookServer
 
 # start logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -16,44 +23,183 @@ dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path)
 TLGR_TOKEN = os.environ.get('TLGR_TOKEN')
 
-# Initialize updater and dispatcher... as like I know what it is
-updater = Updater(token=TLGR_TOKEN)
-dispatcher = updater.dispatcher
-
-# Initialize converter and translator
-my_converter = ARConverter()
+# Number of messages handled at the same time in async mode, 0 - handle messages one by one
+BOT_CONCURRENCY = int(os.environ.get('BOT_CONCURRENCY', 0))
+
+# SQLite file with translated lines and max number of lines in it
+TRANSLATION_CACHE = os.environ.get('TRANSLATION_CACHE', join(dirname(__file__), 'translations.sqlite3'))
+TRANSLATION_CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE', 100000))
+
+# Number of recent messages kept line by line to answer their edits
+MESSAGE_CACHE_SIZE = int(os.environ.get('MESSAGE_CACHE_SIZE', 1000))
+
+# Workers which handle messages - messages wait for them in queues of their chats, and chats are served in turn.
+# 0 - handle messages right in the dispatcher. How many messages could wait in one chat and in all chats
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', 4))
+CHAT_QUEUE_SIZE = int(os.environ.get('CHAT_QUEUE_SIZE', 5))
+BOT_QUEUE_SIZE = int(os.environ.get('BOT_QUEUE_SIZE', 1000))
+
+# 'polling' - the bot asks Telegram for updates, 'webhook' - Telegram posts updates to the bot's HTTP server.
+# Several webhook processes could listen to the same port. WEBHOOK_URL is the public URL registered in Telegram,
+# WEBHOOK_SECRET is checked in every update. TELEGRAM_API_URL could point to a local fake API for tests
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Seconds between checks of measurements.txt and coefficients.json - changed coefficients are reloaded
+# without a restart. 0 - never
+COEFFICIENTS_RELOAD_INTERVAL = float(os.environ.get('COEFFICIENTS_RELOAD_INTERVAL', 60))
+
+# Path of metrics of the scheduler and converters in webhook mode, empty - don't serve them.
+# Seconds between snapshots of the metrics in the log in polling mode, 0 - never
+METRICS_PATH = os.environ.get('METRICS_PATH', '/metrics')
+METRICS_LOG_INTERVAL = float(os.environ.get('METRICS_LOG_INTERVAL', 300))
+
+OVERLOAD_REPLY = 'Слишком много рецептов сразу! Подожди, пока я переведу предыдущие, и пришли этот ещё раз.'
+START_REPLY = """Высылай рецепт!\nЯ переведу его из американской системы счисления в граммы.\
+    Чашки масла, муки и сахара, унции, фунты, кварты и галлоны - в граммы для быстрого измерения на кухонных весах."""
+
+# Initialize updater and dispatcher... as like I know what it is. In webhook mode messages are sent without them
+if BOT_MODE == 'webhook':
+    telegram = TelegramClient(TLGR_TOKEN, TELEGRAM_API_URL)
+else:
+    updater = Updater(token=TLGR_TOKEN)
+    dispatcher = updater.dispatcher
+
+# Initialize converters and translator. Converters are not thread-safe - every worker has its own one
+converters = threading.local()
+all_converters = []
 my_translator = Translator(service_urls=[
       'translate.google.com',
       'translate.google.co.kr',
     ])
+cached_translator = CachedTranslator(GoogleTranslator(my_translator),
+                                     TranslationCache(TRANSLATION_CACHE, TRANSLATION_CACHE_SIZE))
+message_cache = MessageCache(MESSAGE_CACHE_SIZE)
 
+if COEFFICIENTS_RELOAD_INTERVAL:
+    ARConverter.watch_tables(COEFFICIENTS_RELOAD_INTERVAL)
 
-# define reaction to /start command in tlgr
-def start_callback(bot, update):
-    update.message.reply_text("""Высылай рецепт!\nЯ переведу его из американской системы счисления в граммы.\
-    Чашки масла, муки и сахара, унции, фунты, кварты и галлоны - в граммы для быстрого измерения на кухонных весах.""")
 
-def am_ru_convert(bot, update):
-    text = update.message.text.split('\n')
-    my_recipe = ''
+def translate(text):
+    return cached_translator.translate(text, dest='ru')
+
+
+def get_converter():
+    if not hasattr(converters, 'converter'):
+        converters.converter = ARConverter()
+        all_converters.append(converters.converter)
+    return converters.converter
+
+
+def answer_lines(lines):
+    return translate(get_converter().process_text('\n'.join(lines))).split('\n')
+
+
+def send(chat_id, text):
+    if BOT_MODE == 'webhook':
+        return telegram.send_message(chat_id, text)
+    return updater.bot.send_message(chat_id=chat_id, text=text).message_id
+
+
+def edit(chat_id, message_id, text):
+    if BOT_MODE == 'webhook':
+        telegram.edit_message_text(chat_id, message_id, text)
+        return
+    updater.bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id)
 
-    for line in text:
 
-        my_recipe += my_converter.process_line(line) + '\n'
+# In async mode messages are converted in worker processes, and translated and sent concurrently
+pipeline = AsyncPipeline(translate, send, concurrency=BOT_CONCURRENCY, edit=edit, message_cache=message_cache,
+                         reload_interval=COEFFICIENTS_RELOAD_INTERVAL).start() if BOT_CONCURRENCY else None
 
-    bot_answer = my_translator.translate(my_recipe, dest='ru')
 
-    bot.send_message(chat_id=update.message.chat_id, text=bot_answer.text)
+def answer_message(chat_id, message):
+    # In async mode the message is only submitted - the scheduler gets the future and waits for it
+    # in a done-callback, so the worker takes the next chat right away
+    if pipeline:
+        return pipeline.submit(chat_id, message.text, message.message_id)
 
+    message_cache.reply(chat_id, message.message_id, message.text, answer_lines, send, edit)
 
-# define all handlers
-start_handler = CommandHandler("start", start_callback)
-answer_handler = MessageHandler(Filters.text, am_ru_convert)
 
-# adding handlers to our dispatcher
-dispatcher.add_handler(start_handler)
-dispatcher.add_handler(answer_handler)
+def reject_message(chat_id, message):
+    send(chat_id, OVERLOAD_REPLY)
 
-# and start the bot...
-updater.start_polling()
+
+scheduler = ChatScheduler(answer_message, BOT_WORKERS, CHAT_QUEUE_SIZE, BOT_QUEUE_SIZE,
+                          reject_message).start() if BOT_WORKERS else None
+
+
+def export_metrics():
+    # Converters of the async pipeline live in its worker processes, their counters are not here
+    result = scheduler.export_metrics() if scheduler else ''
+    if all_converters:
+        result += all_converters[0].export_metrics(converters=list(all_converters))
+    return result
+
+
+def log_metrics():
+    while True:
+        time.sleep(METRICS_LOG_INTERVAL)
+        lines = {}
+        for converter in list(all_converters):
+            for line_class, count in converter.line_stats().items():
+                lines[line_class] = lines.get(line_class, 0) + count
+        logging.info('Scheduler: %s, lines: %s', scheduler.stats() if scheduler else None, lines)
+
+
+# define reaction to /start command in tlgr
+def start_callback(bot, update):
+    update.message.reply_text(START_REPLY)
+
+def am_ru_convert(bot, update):
+    # New and edited messages - the reply to an edited message is edited too
+    message = update.effective_message
+
+    if scheduler:
+        scheduler.submit(message.chat_id, message)
+        return
+
+    answer_message(message.chat_id, message)
+
+
+def webhook_message(message):
+    # Messages from WebhookServer - it calls this in the thread of the HTTP request
+    if message.text.startswith('/start') and not message.edited:
+        send(message.chat_id, START_REPLY)
+    elif not message.text.startswith('/'):
+        if scheduler:
+            scheduler.submit(message.chat_id, message)
+        else:
+            answer_message(message.chat_id, message)
+
+
+if BOT_MODE == 'webhook':
+    server = WebhookServer(webhook_message, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+                           reuse_port=True, metrics=export_metrics if METRICS_PATH else None,
+                           metrics_path=METRICS_PATH)
+    if WEBHOOK_URL:
+        telegram.set_webhook(WEBHOOK_URL, WEBHOOK_SECRET)
+
+    # and start the bot...
+    server.serve_forever()
+else:
+    # define all handlers
+    start_handler = CommandHandler("start", start_callback)
+    answer_handler = MessageHandler(Filters.text, am_ru_convert, edited_updates=True)
+
+    # adding handlers to our dispatcher
+    dispatcher.add_handler(start_handler)
+    dispatcher.add_handler(answer_handler)
+
+    if METRICS_LOG_INTERVAL:
+        threading.Thread(target=log_metrics, name='MetricsLog', daemon=True).start()
+
+    # and start the bot...
+    updater.start_polling()
 
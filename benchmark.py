@@ -0,0 +1,238 @@
+"""
+Benchmarks of ARConverter on synthetic recipes. Lines are generated from coefficients.json and the unit tables
+for several scenarios - ingredients, ranges, pan sizes, temperatures, links, lines with emojis, instructions
+without amounts, and a mix of all of them. For every scenario the benchmark reports lines/sec for process_line
+and process_lines, latency percentiles of process_line and peak memory.
+
+    python benchmark.py                         # run all scenarios
+    python benchmark.py --save                  # run and save results as the baseline
+    python benchmark.py --compare               # run and compare with the saved baseline
+    python benchmark.py --scenarios ranges temperatures --lines 5000
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+from converter import ARConverter
+from scheduler import percentile
+
+
+BASELINE_FILE = 'benchmark_baseline.json'
+
+PRODUCT_WORDS = ['finely chopped', 'softened', 'melted', 'sifted', 'packed', 'at room temperature', 'divided']
+INSTRUCTIONS = ['Mix well.', 'Stir until smooth and glossy', 'Serve warm with whipped cream', 'Ingredients',
+                'Let it cool completely before slicing', 'Whisk the eggs with sugar until pale and fluffy', '']
+EMOJIS = ['😋', '👍🏽', '🍓', '🧁', '🔥', '❤️', '👨‍🍳', '🇺🇸', '1️⃣']
+PAN_TOOLS = ['pan', 'baking dish', 'cake tin', 'sheet']
+
+
+class RecipeGenerator:
+    """Generates synthetic recipe lines from coefficients and units of ARConverter. The same seed gives
+    the same lines"""
+
+    def __init__(self, seed=0, coefficients=None):
+        self.random = random.Random(seed)
+
+        coefficients = coefficients or ARConverter.shared_tables()[0]
+        self.products = []
+        for product, value in coefficients.items():
+            if isinstance(value, dict):
+                self.products.extend(' '.join(filter(None, [variant, product])) for variant in value)
+            else:
+                self.products.append(product)
+        self.products.sort()
+
+        self.units = [alias for unit in ARConverter.units for alias in unit
+                      if unit[0] not in ('inch', 'cm', 'grams', 'ml') and alias.isalpha()]
+
+        self.scenarios = {'ingredients': self.ingredient, 'ranges': self.range, 'pans': self.pan,
+                          'temperatures': self.temperature, 'links': self.link, 'emoji': self.emoji,
+                          'instructions': self.instruction}
+
+    def lines(self, scenario, number):
+        """Return a list of number lines of the scenario, 'mixed' takes lines of all the scenarios"""
+
+        if scenario == 'mixed':
+            makers = list(self.scenarios.values())
+            return [self.random.choice(makers)() for _ in range(number)]
+
+        return [self.scenarios[scenario]() for _ in range(number)]
+
+    def amount(self):
+        whole = self.random.randint(1, 12)
+        return self.random.choice([str(whole), '{}/{}'.format(self.random.randint(1, 3), 4),
+                                   '{} 1/2'.format(whole), '{}.5'.format(whole), '½', '{}¼'.format(whole)])
+
+    def product(self):
+        product = self.random.choice(self.products)
+        if self.random.random() < 0.3:
+            product = '{}, {}'.format(product, self.random.choice(PRODUCT_WORDS))
+        return product
+
+    def ingredient(self):
+        return '{} {} {}'.format(self.amount(), self.random.choice(self.units), self.product())
+
+    def range(self):
+        first = self.random.randint(1, 5)
+        template = self.random.choice(['{}-{} {} {}', '{} to {} {} {}', '{} - {} {} {}'])
+        return template.format(first, first + self.random.randint(1, 3), self.random.choice(self.units),
+                               self.product())
+
+    def pan(self):
+        size = self.random.choice(['9x13', '8 x 8', '9 x 5', '10x15'])
+        return 'Grease a {} inch {}'.format(size, self.random.choice(PAN_TOOLS))
+
+    def temperature(self):
+        degrees = self.random.randrange(250, 500, 25)
+        template = self.random.choice(['Preheat oven to {}°F', 'Bake at {} F for 25 minutes', 'Preheat oven to {}°',
+                                       'Bake at {} fahrenheit until golden'])
+        return template.format(degrees)
+
+    def link(self):
+        return 'https://www.example.com/recipes/{}-{}'.format(self.random.randint(1, 10 ** 6),
+                                                              self.random.choice(self.products).replace(' ', '-'))
+
+    def emoji(self):
+        return '{} {}'.format(self.ingredient(), self.random.choice(EMOJIS))
+
+    def instruction(self):
+        return self.random.choice(INSTRUCTIONS)
+
+
+def measure(lines, cache_size=0, repeat=3):
+    """Run a fresh converter over the lines repeat times after a warm-up run. Return the best lines/sec
+    of process_line and process_lines, latency percentiles of process_line in microseconds
+    (the best time of every line) and peak memory in KiB"""
+
+    converter = ARConverter(cache_size=cache_size)
+    converter.process_lines(lines)
+    converter.clear_cache()
+
+    latencies = [float('inf')] * len(lines)
+    batch_time = float('inf')
+
+    for _ in range(repeat):
+        for i, line in enumerate(lines):
+            start = time.perf_counter()
+            converter.process_line(line)
+            latencies[i] = min(latencies[i], time.perf_counter() - start)
+        converter.clear_cache()
+
+        start = time.perf_counter()
+        converter.process_lines(lines)
+        batch_time = min(batch_time, time.perf_counter() - start)
+        converter.clear_cache()
+
+    tracemalloc.start()
+    ARConverter(cache_size=cache_size).process_lines(lines)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+
+    return {'lines': len(lines),
+            'lines_per_sec': round(len(lines) / sum(latencies), 1),
+            'batch_lines_per_sec': round(len(lines) / batch_time, 1),
+            'p50_us': round(percentile(latencies, 50) * 10 ** 6, 2),
+            'p90_us': round(percentile(latencies, 90) * 10 ** 6, 2),
+            'p99_us': round(percentile(latencies, 99) * 10 ** 6, 2),
+            'max_us': round(latencies[-1] * 10 ** 6, 2),
+            'peak_memory_kib': round(peak_memory / 1024, 1)}
+
+
+def run_benchmarks(scenarios=None, number=2000, seed=0, cache_size=0, repeat=3):
+    """Measure all the scenarios (or the given ones) on number lines each"""
+
+    generator = RecipeGenerator(seed)
+    scenarios = scenarios or list(generator.scenarios) + ['mixed']
+
+    return {'python': platform.python_version(), 'seed': seed, 'cache_size': cache_size, 'repeat': repeat,
+            'results': {scenario: measure(generator.lines(scenario, number), cache_size, repeat)
+                        for scenario in scenarios}}
+
+
+def compare(results, baseline, threshold=0.1):
+    """Compare lines/sec with the baseline. Return a list of (scenario, metric, old, new, change)
+    where throughput dropped more than threshold (0.1 = 10%)"""
+
+    regressions = []
+
+    for scenario, result in results['results'].items():
+        old_result = baseline['results'].get(scenario)
+        if old_result is None:
+            continue
+
+        for metric in ['lines_per_sec', 'batch_lines_per_sec']:
+            change = result[metric] / old_result[metric] - 1
+            if change < -threshold:
+                regressions.append((scenario, metric, old_result[metric], result[metric], round(change, 3)))
+
+    return regressions
+
+
+def print_results(results, baseline=None, file=None):
+    file = sys.stdout if file is None else file
+
+    columns = ['lines_per_sec', 'batch_lines_per_sec', 'p50_us', 'p90_us', 'p99_us', 'max_us', 'peak_memory_kib']
+    print('{:<14}'.format('scenario') + ''.join('{:>21}'.format(column) for column in columns), file=file)
+
+    for scenario, result in results['results'].items():
+        old_result = (baseline or {}).get('results', {}).get(scenario)
+        cells = []
+        for column in columns:
+            cell = str(result[column])
+            if old_result:
+                cell += ' ({:+.0%})'.format(result[column] / old_result[column] - 1 if old_result[column] else 0)
+            cells.append('{:>21}'.format(cell))
+        print('{:<14}'.format(scenario) + ''.join(cells), file=file)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of ARConverter on synthetic recipes')
+    parser.add_argument('--scenarios', nargs='+', default=None,
+                        help='scenarios to run: ingredients, ranges, pans, temperatures, links, emoji, instructions, '
+                             'mixed. All by default')
+    parser.add_argument('--lines', type=int, default=2000, help='lines in every scenario')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generator of lines')
+    parser.add_argument('--cache-size', type=int, default=0, help='size of the cache of converted lines')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every scenario, the best time is taken')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='file with the baseline results')
+    parser.add_argument('--save', action='store_true', help='save results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare results with the baseline, exit with 1 '
+                                                               'if throughput dropped more than --threshold')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed drop of throughput, 0.1 = 10%%')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    results = run_benchmarks(args.scenarios, args.lines, args.seed, args.cache_size, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION: {} {} {} -> {} ({:+.1%})'.format(*regression))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
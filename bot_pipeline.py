@@ -0,0 +1,122 @@
+"""
+Asynchronous pipeline for the bot. Messages are handled on an asyncio event loop in a background thread:
+conversion runs in a pool of worker processes (every worker builds its own ARConverter once),
+translation and sending run in a pool of threads, so one message waiting for the translator
+doesn't block the others. At most `concurrency` messages are processed at the same time.
+With a MessageCache edited messages are converted and translated again only for changed lines.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from converter import ARConverter
+
+
+logger = logging.getLogger(__name__)
+
+# ARConverter of the current worker, built once by init_converter
+converter = None
+
+
+def init_converter(reload_interval=0):
+    global converter
+    converter = ARConverter(cache_size=10000)
+
+    if reload_interval:
+        ARConverter.watch_tables(reload_interval)
+
+
+def convert_text(text):
+    if converter is None:
+        init_converter()
+
+    return converter.process_text(text)
+
+
+class AsyncPipeline:
+
+    def __init__(self, translate, send, concurrency=8, processes=None, edit=None, message_cache=None,
+                 reload_interval=0):
+        """
+        - translate(text) returns translated text, send(chat_id, text) sends the answer - both are blocking
+        and run in threads
+        - concurrency - how many messages could be processed at the same time
+        - processes - number of processes for conversion, all cores by default. With processes=0
+        conversion runs in one thread of the current process (the converter is not thread-safe)
+        - edit(chat_id, reply_id, text) edits an earlier reply and message_cache keeps answers of messages.
+        With both of them messages submitted with their ids are answered through the cache (see
+        MessageCache.reply) and send should return id of the sent message
+        - reload_interval - every worker process reloads coefficients when they change, checking the files
+        every reload_interval seconds (see ARConverter.watch_tables). 0 - never
+        """
+
+        self.translate = translate
+        self.send = send
+        self.edit = edit
+        self.message_cache = message_cache
+        self.concurrency = concurrency
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='AsyncPipeline', daemon=True)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+        self.io_executor = ThreadPoolExecutor(concurrency * 2, thread_name_prefix='AsyncPipelineIO')
+        if processes == 0:
+            self.convert_executor = ThreadPoolExecutor(1, thread_name_prefix='AsyncPipelineConvert')
+        else:
+            self.convert_executor = ProcessPoolExecutor(processes, initializer=init_converter,
+                                                        initargs=(reload_interval,))
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Wait for all submitted messages and stop the loop and the pools"""
+
+        pending = asyncio.run_coroutine_threadsafe(self.wait_all(), self.loop)
+        pending.result()
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+        self.convert_executor.shutdown()
+        self.io_executor.shutdown()
+
+    async def wait_all(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, chat_id, text, message_id=None):
+        """Put the message in the pipeline and return immediately. Return concurrent.futures.Future
+        with the text of the answer. message_id - id of a new or edited message to answer it through the cache"""
+
+        return asyncio.run_coroutine_threadsafe(self.handle(chat_id, text, message_id), self.loop)
+
+    async def handle(self, chat_id, text, message_id=None):
+        """Convert, translate and send one message"""
+
+        async with self.semaphore:
+            try:
+                if message_id is not None and self.message_cache is not None:
+                    answer = await self.loop.run_in_executor(self.io_executor, self.message_cache.reply, chat_id,
+                                                             message_id, text, self.answer_lines, self.send, self.edit)
+                else:
+                    converted = await self.loop.run_in_executor(self.convert_executor, convert_text, text)
+                    answer = await self.loop.run_in_executor(self.io_executor, self.translate, converted)
+                    await self.loop.run_in_executor(self.io_executor, self.send, chat_id, answer)
+            except Exception:
+                logger.exception('Failed to handle a message from chat %s', chat_id)
+                raise
+
+        return answer
+
+    def answer_lines(self, lines):
+        """Convert and translate a list of lines - blocking, runs in a thread of the pipeline"""
+
+        converted = self.convert_executor.submit(convert_text, '\n'.join(lines)).result()
+
+        return self.translate(converted).split('\n')
@@ -0,0 +1,136 @@
+"""
+Command line tool for offline conversion of big recipe dumps on all cores.
+Reads plain text (every line is converted separately) or JSONL (one recipe per record),
+sends chunks of lines to a pool of processes - every worker builds its own ARConverter once -
+and writes converted recipes in the same order as in the input.
+
+    python bulk_convert.py recipes.txt -o converted.txt
+    python bulk_convert.py recipes.jsonl -o converted.jsonl --format jsonl --field text --workers 8 --chunk-size 256
+
+With --vectorize amounts of every chunk (every recipe in JSONL) are converted together - in one NumPy pass
+if NumPy is installed.
+"""
+
+import sys
+import json
+import argparse
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+from converter import ARConverter
+
+
+# ARConverter of the current worker process, built once by init_worker
+converter = None
+
+
+def init_worker(cache_size=0, vectorize=False):
+    global converter
+    converter = ARConverter(cache_size=cache_size, vectorize=vectorize)
+
+
+def convert_lines(chunk):
+    """Convert a chunk of plain text lines"""
+
+    return [line + '\n' for line in converter.process_lines([line.rstrip('\r\n') for line in chunk])]
+
+
+def convert_records(chunk, field='text'):
+    """Convert a chunk of JSONL records. A record is either a JSON string with the whole recipe
+    or an object with the recipe in the given field, other records are written unchanged"""
+
+    result = []
+
+    for line in chunk:
+        if not line.strip():
+            continue
+
+        record = json.loads(line)
+
+        if isinstance(record, str):
+            record = converter.process_text(record)
+        elif isinstance(record, dict) and isinstance(record.get(field), str):
+            record[field] = converter.process_text(record[field])
+
+        result.append(json.dumps(record, ensure_ascii=False) + '\n')
+
+    return result
+
+
+def make_chunks(lines, chunk_size):
+    """Group lines of the input in lists of chunk_size lines"""
+
+    chunk = []
+
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def convert_file(input_file, output_file, file_format='text', field='text', workers=None, chunk_size=256,
+                 cache_size=0, vectorize=False):
+    """Convert all the lines or records from input_file and write them to output_file keeping the order.
+    With workers=1 everything is converted in the current process"""
+
+    if file_format == 'jsonl':
+        convert_chunk = partial(convert_records, field=field)
+    else:
+        convert_chunk = convert_lines
+
+    chunks = make_chunks(input_file, chunk_size)
+    workers = workers or cpu_count()
+
+    if workers == 1:
+        init_worker(cache_size, vectorize)
+        for chunk in chunks:
+            output_file.writelines(convert_chunk(chunk))
+        return
+
+    with Pool(workers, initializer=init_worker, initargs=(cache_size, vectorize)) as pool:
+        for converted in pool.imap(convert_chunk, chunks):
+            output_file.writelines(converted)
+
+        # Let workers exit normally and write their logs
+        pool.close()
+        pool.join()
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Convert american measurements in recipes to grams and cm')
+    parser.add_argument('input', help="file with recipes, '-' for stdin")
+    parser.add_argument('-o', '--output', default='-', help="file for converted recipes, '-' for stdout")
+    parser.add_argument('--format', dest='file_format', choices=['text', 'jsonl'], default='text',
+                        help='text - convert every line, jsonl - one recipe per record')
+    parser.add_argument('--field', default='text', help='field with the recipe in JSONL records')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, all cores by default')
+    parser.add_argument('--chunk-size', type=int, default=256, help='lines (or records) sent to a worker at once')
+    parser.add_argument('--cache-size', type=int, default=10000, help='size of the cache of converted lines per worker')
+    parser.add_argument('--vectorize', action='store_true', help='convert amounts of a chunk at once, with NumPy '
+                                                                 'if it is installed')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+
+    input_file = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+
+    try:
+        convert_file(input_file, output_file, args.file_format, args.field, args.workers, args.chunk_size,
+                     args.cache_size, args.vectorize)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,48 +6,945 @@ and finishing with cups/tsp/Tbsp to grams
 
 import re
 import json
+import time
+import queue
+import atexit
 import os.path
 import logging
-import demoji
+import threading
+from multiprocessing import util
+from logging.handlers import QueueHandler, QueueListener
+from types import MappingProxyType
+from functools import wraps
+from itertools import islice
+from collections import namedtuple, OrderedDict
+
+# NumPy is optional - numbers of a batch are converted in a vectorized pass with it, one by one without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Kinds of tokens emitted by ARConverter.tokenize
+NUMBER = 'number'
+FRACTION = 'fraction'
+RANGE = 'range'
+UNIT = 'unit'
+TEMPERATURE = 'temperature'
+INGREDIENT = 'ingredient'
+WORD = 'word'
+
+# Classes of lines detected by ARConverter.classify_line before the conversion.
+# PASSTHROUGH and LINK lines are only cleaned, TEMPERATURE_ONLY and CONVERT lines are converted the same way
+PASSTHROUGH = 'passthrough'
+LINK = 'link'
+TEMPERATURE_ONLY = 'temperature'
+CONVERT = 'convert'
+
+# Groups of Metrics
+STAGES = 'stage'
+CONVERSIONS = 'conversion'
+
+# Kinds of numeric conversions of amounts, see NumberBatch
+CELSIUS = 'celsius'
+GRAMS = 'grams'
+CENTIMETERS = 'cm'
+
+GRAMS_IN_OZ = 28.35
+GRAMS_IN_LB = 453.6
+CM_IN_INCH = 2.54
+
+Token = namedtuple('Token', ['kind', 'text', 'start', 'end'])
+
+NUMBER_TEMPLATE = r'\d+[.,]\d+|\d+[ ]+\d+/\d+|\d+/\d+|\d+'
+TOKEN_PATTERN = re.compile(r'(?P<number>{})|(?P<word>[A-Za-z]+)|(?P<sign>[-+])'.format(NUMBER_TEMPLATE))
+NUMBER_PATTERN = re.compile(NUMBER_TEMPLATE)
+AMOUNT_PATTERN = re.compile(r'\d+[.,]\d+|\d*[ ]*\d+[/]\d+|\d+')
+WORD_PATTERN = re.compile(r'[A-Za-z]+')
+LINK_PATTERN = re.compile(r'https|www|\.com')
+
+# Placeholders of converted amounts in planned edits of a batch - characters from the private use area
+PLACEHOLDER_TEMPLATE = '\ue000{}\ue001'
+PLACEHOLDER_PATTERN = re.compile('\ue000(\\d+)\ue001')
+
+SYMBOLS_TO_REPLACE = {'⅛': '1/8', '½': '1/2', '⅓': '1/3', '¼': '1/4', '⅔': '2/3', '¾': '3/4', '°': '', '″': 'inch',
+                      "''": 'inch', '×': 'x', '–': '-', '⅜': '3/8', '⅝': '5/8', '⅞': '7/8', '⅕': '1/5', '⅖': '2/5',
+                      '⅗': '3/5', '⅘': '4/5', '⅙': '1/6', '⅚': '5/6', '⅐': '1/7', '⅑': '1/9', '⅒': '1/10'}
+
+# Symbols replaced without a space before them - the fraction slash and non-breaking and thin spaces
+SYMBOLS_TO_NORMALIZE = {'⁄': '/', '\u00a0': ' ', '\u2009': ' ', '\u202f': ' '}
+
+# Both tables compiled once. Only ASCII symbols could be found in ASCII lines
+SYMBOL_REPLACEMENTS = (tuple((key, ' ' + value) for key, value in SYMBOLS_TO_REPLACE.items()) +
+                       tuple(SYMBOLS_TO_NORMALIZE.items()))
+ASCII_SYMBOL_REPLACEMENTS = tuple((key, value) for key, value in SYMBOL_REPLACEMENTS if key.isascii())
+
+# A line without these signs has no amounts at all, and symbols which become a unit of measure
+AMOUNT_SIGN_PATTERN = re.compile(r'[\d{}]'.format(''.join(key for key, value in SYMBOLS_TO_REPLACE.items()
+                                                          if any(char.isdigit() for char in value))))
+# Codepoint ranges of emojis and pictographs, and of the parts of emoji sequences -
+# joiners, variation selectors, skin tones and tags of flags
+EMOJI_RANGES = ((0x00A9, 0x00A9), (0x00AE, 0x00AE), (0x200D, 0x200D), (0x203C, 0x203C), (0x2049, 0x2049),
+                (0x20E3, 0x20E3), (0x2122, 0x2122), (0x2139, 0x2139), (0x2194, 0x2199), (0x21A9, 0x21AA),
+                (0x231A, 0x231B), (0x2328, 0x2328), (0x23CF, 0x23CF), (0x23E9, 0x23F3), (0x23F8, 0x23FA),
+                (0x24C2, 0x24C2), (0x25AA, 0x25AB), (0x25B6, 0x25B6), (0x25C0, 0x25C0), (0x25FB, 0x25FE),
+                (0x2600, 0x27BF), (0x2934, 0x2935), (0x2B05, 0x2B07), (0x2B1B, 0x2B1C), (0x2B50, 0x2B50),
+                (0x2B55, 0x2B55), (0x3030, 0x3030), (0x303D, 0x303D), (0x3297, 0x3297), (0x3299, 0x3299),
+                (0xFE0E, 0xFE0F), (0x1F000, 0x1FAFF), (0xE0020, 0xE007F))
+
+# Keycaps such as 1️⃣ are deleted together with their digit
+EMOJI_PATTERN = re.compile(r'[0-9#*]\ufe0f?\u20e3|[{}]'.format(
+    ''.join(r'\U{:08x}-\U{:08x}'.format(first, last) for first, last in EMOJI_RANGES)))
+
+UNIT_SIGN_PATTERN = re.compile('|'.join(re.escape(key) for key, value in SYMBOLS_TO_REPLACE.items()
+                                        if value.isalpha()))
+
+
+class LineCache:
+    """Bounded LRU cache of converted lines - key is a raw input line, value is a converted line.
+    Counts hits, misses and evictions"""
+
+    def __init__(self, size):
+        self.size = size
+        self.lines = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, line):
+        """Return converted line or None if there is no such line in the cache"""
+
+        result = self.lines.get(line)
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.lines.move_to_end(line)
+        self.hits += 1
 
+        return result
 
-class ARConverter:
+    def put(self, line, result):
+        """Save converted line, delete the least recently used line if the cache is full"""
+
+        self.lines[line] = result
+        self.lines.move_to_end(line)
+
+        if len(self.lines) > self.size:
+            self.lines.popitem(last=False)
+            self.evictions += 1
+
+        return result
+
+    def clear(self):
+        self.lines.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.lines)}
+
+
+class Metrics:
+    """Cumulative time and number of calls of the stages of the conversion (STAGES)
+    and of every kind of conversion - cup, ml, oz, lb, inch, fahrenheit, celsius_warning and inch_warning (CONVERSIONS).
+    Times of stages are inclusive - break_line includes find_double_numbers and look_around_number.
+    Every converted quantity is counted once under its kind - ml converted through cups is only ml"""
 
     def __init__(self):
+        self.groups = {STAGES: {}, CONVERSIONS: {}}
+
+    def record(self, group, name, seconds):
+        calls = self.groups[group].get(name)
+        if calls is None:
+            self.groups[group][name] = [1, seconds]
+        else:
+            calls[0] += 1
+            calls[1] += seconds
+
+    def snapshot(self):
+        """Return {group: {name: {'calls': calls, 'seconds': seconds}}}"""
+
+        return {group: {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in names.items()}
+                for group, names in self.groups.items()}
+
+    def reset(self):
+        for names in self.groups.values():
+            names.clear()
+
+
+def timed(name, group=STAGES):
+    """Decorator for methods of ARConverter - records time and calls of the method in self.metrics.
+    If metrics are disabled the method is just called"""
+
+    def decorator(method):
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.record(group, name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class UnknownProducts:
+    """Counts products which are missing in coefficients: product -> [count, sample line].
+    Instead of a log line for every occurrence, the ranked list is written to the log
+    every flush_interval seconds (and at exit)"""
+
+    def __init__(self, logger, flush_interval=600):
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self.products = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def add(self, product, line):
+        with self.lock:
+            record = self.products.get(product)
+            if record:
+                record[0] += 1
+            else:
+                self.products[product] = [1, line]
+
+            flush = time.monotonic() - self.last_flush >= self.flush_interval
+
+        if flush:
+            self.flush()
+
+    def top(self, number=None):
+        """Return list of (product, count, sample line) sorted by count, since the last flush"""
+
+        with self.lock:
+            products = [(product, count, line) for product, (count, line) in self.products.items()]
+
+        products.sort(key=lambda product: product[1], reverse=True)
+
+        return products[:number]
+
+    def flush(self):
+        """Write the ranked list to the log and start counting from scratch. Return the ranked list"""
+
+        products = self.top()
+
+        with self.lock:
+            self.products = {}
+            self.last_flush = time.monotonic()
+
+        if products:
+            lines = ['{} - {} (for example: {})'.format(count, product, line) for product, count, line in products]
+            self.logger.info('INVALID PRODUCTS:\n' + '\n'.join(lines))
+
+        return products
+
+
+class IngredientMatcher:
+    """Trie over lower case words of product names from coefficients.json. Finds the longest product
+    in a line - 'brown sugar', 'all purpose flour' or just 'sugar' - and its variant in one pass.
+    Multi-word products are matched in both orders of words - 'chocolate chips' and 'chips chocolate'.
+    Grams are taken from the flat (product, variant) index, see make_constant_file.make_coefficient_index"""
+
+    def __init__(self, coefficients, root=None, index=None):
+        """root and index - already built trie and (index, variants), for example loaded from the compiled
+        coefficients file"""
+
+        if index is None:
+            from make_constant_file import make_coefficient_index
+            index = make_coefficient_index(coefficients)
+
+        self.index, self.variants = index
+        self.root = {} if root is None else root
+
+        if root is not None:
+            return
+
+        for item, value in coefficients.items():
+            item_words = WORD_PATTERN.findall(item.lower())
+
+            if type(value) != dict:
+                self.add(item_words, item, '')
+                continue
+
+            for spec in value:
+                spec_words = WORD_PATTERN.findall(spec.lower())
+                self.add(spec_words + item_words, item, ' '.join(spec_words))
+                self.add(item_words + spec_words, item, ' '.join(spec_words))
+
+    def coefficient(self, item, words, variant=None):
+        """Return grams in 1 cup of the item or None if it's unknown. variant - the one matched with the item
+        by the trie ('all purpose' for flour, '' for the default). If it's not known, a product with variants -
+        Brown Sugar - takes the first one-word variant from the line if there is any, or the default one"""
+
+        if variant is None:
+            variants = self.variants.get(item)
+            found = variants.intersection([word.lower() for word in words]) if variants else None
+
+            if not found:
+                variant = ''
+            elif len(found) == 1:
+                variant = next(iter(found))
+            else:
+                variant = next(word.lower() for word in words if word.lower() in found)
+
+        return self.index.get((item, variant))
+
+    def add(self, words, item, variant):
+        """Add product name as a list of words. The first added (item, variant) for a name is kept"""
+
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+
+        node.setdefault('', (item, variant))
+
+    def match(self, words):
+        """Find the longest product in the list of lower case words. If there are several products with the same
+        length, take the last one. Return (item, variant) or None"""
+
+        return self.longest(self.match_all(words))
+
+    @staticmethod
+    def longest(matches):
+        """Return (item, variant) of the longest of matches found by match_all - the last one
+        if there are several with the same length, or None if there are no matches"""
+
+        best = None
+        best_length = 0
+
+        for start, length, item, variant in matches:
+            if length >= best_length:
+                best = (item, variant)
+                best_length = length
+
+        return best
+
+    def match_all(self, words):
+        """Find the longest product starting from every word of the list of lower case words.
+        Return a list of (index of the first word, number of words, item, variant) in the order of the words"""
+
+        result = []
+
+        for start in range(len(words)):
+            node = self.root
+            found = None
+
+            for end in range(start, len(words)):
+                node = node.get(words[end])
+                if node is None:
+                    break
+
+                if '' in node:
+                    found = (start, end - start + 1) + node['']
+
+            if found:
+                result.append(found)
+
+        return result
+
+
+class Quantity:
+    """One amount in the line - its text, value and (start, end) position, the unit of measure next to it
+    (canonical name, text and position), the range ('4-5', '9x13') it belongs to, if it could be Fahrenheit
+    and the product it measures with its variant"""
+
+    __slots__ = ('text', 'value', 'span', 'unit', 'unit_text', 'unit_span', 'range', 'fahrenheit', 'item', 'variant')
+
+    def __init__(self, text, value, span):
+        self.text = text
+        self.value = value
+        self.span = span
+
+        self.unit = None
+        self.unit_text = None
+        self.unit_span = None
+        self.range = None
+        self.fahrenheit = False
+        self.item = ''
+        self.variant = ''
+
+    def __repr__(self):
+        return 'Quantity({!r}, {!r}, unit={!r}, fahrenheit={!r})'.format(self.text, self.value, self.unit,
+                                                                         self.fahrenheit)
+
+
+class ParsedLine:
+    """Components of the line found by ARConverter.break_line: quantities in the order of the line,
+    possible inches ({'9x13': True}), the item with its variant and all the words of the line"""
+
+    __slots__ = ('quantities', 'possible_inch', 'item', 'variant', 'words')
+
+    def __init__(self, quantities, possible_inch, item='', variant='', words=()):
+        self.quantities = quantities
+        self.possible_inch = possible_inch
+        self.item = item
+        self.variant = variant
+        self.words = words
+
+
+class LineEdits:
+    """Planned replacements in a line. Every edit is a span of the original line and a new text for it,
+    so indexes found in the original line stay valid while edits are planned. Edits can't overlap -
+    an edit conflicting with already planned ones is rejected. All edits are applied at once in apply()"""
+
+    def __init__(self, line):
+        self.line = line
+        self.edits = []
+        self.suffixes = []
+
+    def replace(self, what, to_what, start=0, end=None, whole_word=False):
+        """Plan replacement of the first occurrence of 'what' between start and end
+        which doesn't conflict with other edits. Return True if the edit is planned"""
+
+        end = len(self.line) if end is None else end
+        position = self.line.find(what, start, end)
+
+        while position != -1:
+            position_end = position + len(what)
+
+            if (not whole_word or self.is_whole_word(position, position_end)) and \
+                    not self.conflicts(position, position_end):
+                self.edits.append((position, position_end, to_what))
+                return True
+
+            position = self.line.find(what, position + 1, end)
+
+        return False
+
+    def append(self, text):
+        """Plan adding text at the end of the line"""
+
+        self.suffixes.append(text)
+
+    def conflicts(self, start, end):
+        """Check if the span overlaps any planned edit"""
+
+        for edit_start, edit_end, _ in self.edits:
+            if start < edit_end and edit_start < end:
+                return True
+
+        return False
+
+    def is_whole_word(self, start, end):
+        """Check that the span doesn't cut a word or a number in the middle"""
+
+        return (start == 0 or not self.is_same_kind(self.line[start - 1], self.line[start])) and \
+               (end == len(self.line) or not self.is_same_kind(self.line[end - 1], self.line[end]))
+
+    @staticmethod
+    def is_same_kind(left, right):
+        return (left.isalpha() and right.isalpha()) or (left.isdigit() and right.isdigit())
+
+    def apply(self):
+        """Return the line with all planned edits"""
+
+        pieces = []
+        position = 0
+
+        for start, end, text in sorted(self.edits):
+            pieces.append(self.line[position:start])
+            pieces.append(text)
+            position = end
+
+        pieces.append(self.line[position:])
+
+        return ''.join(pieces + self.suffixes)
+
+
+class NumberBatch:
+    """Numeric conversions of amounts of many lines calculated at once. add() returns a placeholder for planned
+    edits of a line, calculate() converts all the amounts - in one vectorized pass if NumPy is installed -
+    and fill() puts formatted results instead of the placeholders. Results are the same as of convert(),
+    the scalar conversion, rounding included"""
+
+    # Larger amounts are converted one by one - float64 can't keep them exactly
+    max_vectorized = 2 ** 49
+
+    def __init__(self, vectorized=True):
+        self.vectorized = vectorized and numpy is not None
+        self.kinds = []
+        self.values = []
+        self.factors = []
+        self.results = None
+
+    @staticmethod
+    def convert(kind, value, factor=1):
+        """Convert one amount:
+        - CELSIUS - Fahrenheit degrees to Celsius
+        - GRAMS - value multiplied by factor - grams in an ounce, a pound or a cup of the product
+        - CENTIMETERS - inches to cm, small results are rounded to 2 decimal places"""
+
+        if kind == CELSIUS:
+            return round((value - 32)*5/9)
+
+        if kind == CENTIMETERS:
+            result = value*CM_IN_INCH
+            if result <= 5:
+                return round(result, 2)
+            return round(result)
+
+        return round(value*factor)
+
+    def add(self, kind, value, factor=1):
+        """Plan conversion of the amount and return the placeholder of its result"""
+
+        self.kinds.append(kind)
+        self.values.append(value)
+        self.factors.append(factor)
+
+        return PLACEHOLDER_TEMPLATE.format(len(self.values) - 1)
+
+    def calculate(self):
+        """Convert all planned amounts and return the list of formatted results"""
+
+        if not self.vectorized or not self.values:
+            self.results = [str(self.convert(*amount)) for amount in zip(self.kinds, self.values, self.factors)]
+            return self.results
+
+        kinds = numpy.array(self.kinds)
+        values = numpy.array(self.values, dtype=numpy.float64)
+        factors = numpy.array(self.factors, dtype=numpy.float64)
+        celsius = kinds == CELSIUS
+        centimeters = kinds == CENTIMETERS
+
+        # The same operations in the same order as in convert() give the same floats, and numpy.rint
+        # rounds half to even like round()
+        results = values*factors
+        results[celsius] = (values[celsius] - 32)*5/9
+        results[centimeters] = values[centimeters]*CM_IN_INCH
+
+        exact = numpy.abs(values) < self.max_vectorized
+        rounded = numpy.rint(numpy.where(exact, results, 0)).astype(numpy.int64)
+        self.results = [str(number) for number in rounded.tolist()]
+
+        # round(x, 2) is correctly rounded in decimals, numpy.round isn't - small centimeters and too large
+        # amounts are converted one by one
+        for index in numpy.flatnonzero(~exact | (centimeters & (results <= 5))).tolist():
+            self.results[index] = str(self.convert(self.kinds[index], self.values[index], self.factors[index]))
+
+        return self.results
+
+    def fill(self, edits):
+        """Put the results in the planned edits (LineEdits) instead of placeholders and return the edits"""
+
+        edits.edits = [(start, end, self.fill_text(text)) for start, end, text in edits.edits]
+        edits.suffixes = [self.fill_text(text) for text in edits.suffixes]
+
+        return edits
+
+    def fill_text(self, text):
+        if '\ue000' not in text:
+            return text
+
+        return PLACEHOLDER_PATTERN.sub(lambda match: self.results[int(match.group(1))], text)
+
+
+class TablesWatcher:
+    """Polls modification times and sizes of the files with coefficients every interval seconds
+    and calls reload() in its own thread when any of them changes"""
+
+    def __init__(self, paths, reload, interval=5.0):
+        self.paths = paths
+        self.reload = reload
+        self.interval = interval
+        self.pid = os.getpid()
+
+        self.state = self.files_state()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, name='TablesWatcher', daemon=True)
+
+    def files_state(self):
+        state = []
+
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                state.append(None)
+
+        return state
+
+    def check(self):
+        """Reload the tables if the files changed since the last check. Return True if they changed.
+        Files written by the reload itself (coefficients.json) are seen as changed on the next check -
+        reload_tables doesn't replace the tables if the coefficients are the same"""
+
+        state = self.files_state()
+        if state == self.state:
+            return False
+
+        self.state = state
+        self.reload()
+
+        return True
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+class ARConverter:
+
+    # Volume of different tools in ml
+    ml_measures = {'tbsp': 15, 'gallon': 3875.4, 'pint': 473, 'quart': 946.4, 'cup': 240, 'stick': 120,
+                   'floz': 29.5}
+
+    # Units of measure - the first name in every list is the canonical one
+    units = [['cup', 'cups', 'c'], ['oz', 'ounce', 'ounces'], ['lb', 'lbs', 'pound', 'pounds'],
+             ['grams', 'gr', 'gram', 'g'], ['tsp', 'teaspoon', 'ts'], ['tbsp', 'tablespoon', 'tablespoons', 'tbs'],
+             ['gallon', 'gallons'], ['pint', 'pints'], ['quart', 'quarts'], ['stick', 'sticks'],
+             ['ml', 'milliliters', 'milliliter'], ['floz'], ['inch', 'inches', 'in', "''"], ['cm', 'cantimeters']]
+    fahrenheit_names = ['f', 'fahrenheit', 'fahrenheits']
+    celsius_names = ['c', 'celsius']
+    range_words = ['to', '-', 'x', '+']
+
+    # Case folded alias -> canonical name indexes for all unit and temperature detection
+    unit_aliases = {alias.casefold(): unit[0] for unit in units for alias in unit}
+    temperature_aliases = dict([(name, 'fahrenheit') for name in fahrenheit_names] +
+                               [(name, 'celsius') for name in celsius_names])
+
+    # Coefficients and ingredient trie shared by all converters, and the logger - both are set up only once.
+    # The tables are replaced as a whole by reload_tables, tables_watcher calls it when the files change
+    tables = None
+    tables_lock = threading.Lock()
+    tables_watcher = None
+    reload_counts = {'reloads': 0, 'failures': 0, 'last_seconds': 0.0, 'last_time': None}
+    logger = None
+    logger_pid = None
+    log_listener = None
+    unknown_products = None
+
+    __slots__ = ('cache', '_coefficients', 'ingredients', 'line_counts', 'metrics', 'vectorize', 'numbers',
+                 '_tables')
+
+    def __init__(self, cache_size=0, metrics=False, vectorize=False):
         """
         - self.coefficients defines dictionary with key:value pairs as
         key = item (product), value - how many grams in 1 cup.
         Takes all values from coefficients.json file, which was made in make_constant_file.py
-        module before initializing this class
+        module before initializing this class. The values are loaded once and shared (read-only)
+        by all converters. After reload_tables converters take the new values before the next line
 
-        - self.ml_measures defines volume of different tools in ml
+        - self.cache keeps up to cache_size converted lines for process_line and process_lines.
+        Disabled if cache_size is 0
+
+        - self.line_counts counts processed lines by classes from classify_line
+
+        - self.metrics records time and calls of the stages of the conversion if metrics=True, see Metrics
+
+        - self.vectorize - amounts of all the lines of process_lines are converted at once by NumberBatch,
+        with NumPy if it's installed. self.numbers is the NumberBatch of the current batch
         """
 
-        self.logger = self.set_logger()
+        self.set_logger()
+        self.cache = LineCache(cache_size) if cache_size > 0 else None
+        self.line_counts = dict.fromkeys((PASSTHROUGH, LINK, TEMPERATURE_ONLY, CONVERT), 0)
+        self.metrics = Metrics() if metrics else None
+        self.vectorize = vectorize
+        self.numbers = None
+
+        self.use_shared_tables()
+
+    @classmethod
+    def register_unit(cls, alias, unit=None, ml=None):
+        """Add a new name for a unit of measure, for example register_unit('kg'),
+        register_unit('tablespoonful', 'tbsp') or register_unit('dl', ml=100).
+        unit - canonical name of the unit, the alias itself by default
+        ml - volume of the unit in ml, if it should be converted to grams like cups
+        The unit is available for all converters - clear caches of already existing ones"""
 
-        self.coefficients = dict()
-        file_dir = os.path.dirname(os.path.abspath(__file__))
+        unit = unit or alias
+        cls.unit_aliases[alias.casefold()] = unit
+        cls.unit_aliases[unit.casefold()] = unit
 
-        with open(os.path.join(file_dir, 'coefficients.json'), 'r') as coefficients:
-            self.coefficients = json.load(coefficients)
+        if ml is not None:
+            cls.ml_measures[unit] = ml
 
-        self.ml_measures = {'tbsp': 15, 'gallon': 3875.4, 'pint': 473, 'quart': 946.4, 'cup': 240, 'stick': 120,
-                            'floz': 29.5}
+    def find_unit(self, word):
+        """Return canonical name of the unit of measure or None if the word is not a unit"""
 
-        self.units = [['cup', 'cups', 'c'], ['oz', 'ounce', 'ounces'], ['lb', 'lbs', 'pound', 'pounds'],
-                      ['grams', 'gr', 'gram', 'g'], ['tsp', 'teaspoon', 'ts'], ['tbsp', 'tablespoon', 'tablespoons', 'tbs'],
-                      ['gallon', 'gallons'], ['pint', 'pints'], ['quart', 'quarts'], ['stick', 'sticks'],
-                      ['ml', 'milliliters', 'milliliter'], ['floz'], ['inch', 'inches', 'in', "''"], ['cm', 'cantimeters']]
-        self.fahrenheit_names = ['f', 'fahrenheit', 'fahrenheits']
-        self.celsius_names = ['c', 'celsius']
+        return self.unit_aliases.get(word.casefold())
 
-        # Download the base with emojies. Disable for tests
-        # demoji.download_codes()
+    def find_temperature(self, word):
+        """Return 'fahrenheit', 'celsius' or None if the word is not a temperature word"""
+
+        return self.temperature_aliases.get(word.casefold())
+
+    @classmethod
+    def shared_tables(cls):
+        """Load coefficients and the ingredient trie once for all converters. Coefficients are read-only"""
+
+        with ARConverter.tables_lock:
+            if ARConverter.tables is None:
+                coefficients, ingredients = cls.load_tables()
+                ARConverter.tables = (MappingProxyType(coefficients), ingredients)
+
+        return ARConverter.tables
+
+    @classmethod
+    def reload_tables(cls, file_dir=None):
+        """Rebuild coefficients and the ingredient trie from the files (see load_tables) and replace
+        the shared tables at once. Converters take the new tables before their next line or batch, lines
+        in progress are converted with the old ones. If the files are broken the old tables are kept.
+        Return True if the tables are replaced - they are not if the coefficients didn't change"""
+
+        logger = cls.set_logger()
+        start = time.perf_counter()
+
+        try:
+            coefficients, ingredients = cls.load_tables(file_dir)
+            if not coefficients:
+                raise ValueError('no coefficients')
+        except Exception:
+            logger.exception('Failed to reload coefficients, the old ones are kept')
+            with ARConverter.tables_lock:
+                ARConverter.reload_counts['failures'] += 1
+            return False
+
+        tables = (MappingProxyType(coefficients), ingredients)
+        seconds = time.perf_counter() - start
+
+        with ARConverter.tables_lock:
+            if ARConverter.tables is not None and ARConverter.tables[0] == coefficients:
+                return False
+
+            ARConverter.tables = tables
+            ARConverter.reload_counts.update(reloads=ARConverter.reload_counts['reloads'] + 1,
+                                             last_seconds=seconds, last_time=time.time())
+
+        logger.info('Coefficients reloaded: {} products in {:.3f} s'.format(len(coefficients), seconds))
+        return True
+
+    @classmethod
+    def watch_tables(cls, interval=5.0, file_dir=None):
+        """Start watching measurements.txt and coefficients.json - the tables are reloaded in the background
+        when the files change, no restart is needed. One watcher per process, return it"""
+
+        from make_constant_file import COEFFICIENTS_FILE
+
+        with ARConverter.tables_lock:
+            watcher = ARConverter.tables_watcher
+            if watcher is not None and watcher.pid == os.getpid():
+                return watcher
+
+            file_dir = file_dir or os.path.dirname(os.path.abspath(__file__))
+            paths = [os.path.join(file_dir, 'measurements.txt'), os.path.join(file_dir, COEFFICIENTS_FILE)]
+
+            ARConverter.tables_watcher = TablesWatcher(paths, lambda: cls.reload_tables(file_dir), interval).start()
+            return ARConverter.tables_watcher
+
+    @classmethod
+    def stop_watching_tables(cls):
+        with ARConverter.tables_lock:
+            watcher, ARConverter.tables_watcher = ARConverter.tables_watcher, None
+
+        if watcher is not None and watcher.pid == os.getpid():
+            watcher.stop()
+
+    @classmethod
+    def reload_stats(cls):
+        """Return number of reloads and failed reloads of the tables, duration of the last reload in seconds,
+        its time and the number of products in the current tables"""
+
+        with ARConverter.tables_lock:
+            stats = dict(ARConverter.reload_counts)
+            stats['products'] = len(ARConverter.tables[0]) if ARConverter.tables is not None else 0
+
+        return stats
+
+    @classmethod
+    def load_tables(cls, file_dir=None):
+        """Load coefficients and the ingredient trie from the compiled file made by make_constant_file.py.
+        If the compiled file is missing or older than measurements.txt or coefficients.json - rebuild it
+        (and coefficients.json as well, if measurements.txt is newer). Return (coefficients, ingredients)"""
+
+        from make_constant_file import MeasurementsFileMaker, COEFFICIENTS_FILE, COMPILED_FILE, \
+            compile_coefficients, load_compiled_coefficients
+
+        file_dir = file_dir or os.path.dirname(os.path.abspath(__file__))
+        json_path = os.path.join(file_dir, COEFFICIENTS_FILE)
+        compiled_path = os.path.join(file_dir, COMPILED_FILE)
+        measurements_path = os.path.join(file_dir, 'measurements.txt')
+
+        json_time = cls.get_mtime(json_path)
+        measurements_time = cls.get_mtime(measurements_path)
+
+        if cls.get_mtime(compiled_path) >= max(json_time, measurements_time):
+            tables = load_compiled_coefficients(compiled_path)
+            if tables:
+                return tables['coefficients'], IngredientMatcher(tables['coefficients'], tables['ingredients'],
+                                                                 (tables['index'], tables['variants']))
+
+        if measurements_time > json_time:
+            maker = MeasurementsFileMaker(measurements_path, write=False)
+            coefficients = maker.dic_coefficients
+            index = maker.index
+            write_files = maker.write_files
+        else:
+            with open(json_path, 'r') as coefficients_file:
+                coefficients = json.load(coefficients_file)
+            index = None
+            write_files = lambda: compile_coefficients(coefficients, compiled_path)
+
+        # The directory could be read-only - then just use the tables from memory
+        try:
+            write_files()
+        except OSError:
+            pass
+
+        return coefficients, IngredientMatcher(coefficients, index=index)
+
+    @staticmethod
+    def get_mtime(path):
+        """Return modification time of the file or 0 if there is no such file"""
+
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
+    @property
+    def coefficients(self):
+        return self._coefficients
+
+    @coefficients.setter
+    def coefficients(self, coefficients):
+        self.set_coefficients(coefficients)
+
+    def set_coefficients(self, coefficients, ingredients=None):
+        """Set coefficients and the ingredient trie for them (it's built if not given).
+        Converted lines depend on coefficients - clear the cache every time they change.
+        The converter keeps these coefficients after reloads of the shared tables"""
+
+        self._coefficients = coefficients
+        self.ingredients = ingredients or IngredientMatcher(coefficients)
+        self._tables = None
+        self.clear_cache()
+
+    def use_shared_tables(self):
+        tables = self.shared_tables()
+        self.set_coefficients(*tables)
+        self._tables = tables
+
+    def refresh_tables(self):
+        """Take the shared tables if they were reloaded since the last line - a line is always converted
+        with one version of the tables"""
+
+        if self._tables is not None and self._tables is not ARConverter.tables:
+            self.use_shared_tables()
+
+    def clear_cache(self):
+        """Clear the cache of converted lines. Call it after changing self.coefficients in place"""
+
+        if self.cache is not None:
+            self.cache.clear()
+
+    def cache_stats(self):
+        """Return hits, misses, evictions and current size of the cache, or None if the cache is disabled"""
+
+        if self.cache is None:
+            return None
+
+        return self.cache.stats()
+
+    def line_stats(self):
+        """Return how many lines of every class (passthrough, link, temperature, convert) were processed"""
+
+        return dict(self.line_counts)
+
+    def enable_metrics(self):
+        if self.metrics is None:
+            self.metrics = Metrics()
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def metrics_stats(self):
+        """Return time and calls of the stages and kinds of conversion, or None if metrics are disabled"""
+
+        if self.metrics is None:
+            return None
+
+        return self.metrics.snapshot()
+
+    def export_metrics(self, prefix='arconverter', converters=None):
+        """Return counters of lines, stages and kinds of conversion in Prometheus text exposition format.
+        converters - list of converters (for example of all worker threads) to sum their counters,
+        only this converter by default"""
+
+        converters = [self] if converters is None else converters
+        line_counts = {line_class: sum(converter.line_counts[line_class] for converter in converters)
+                       for line_class in self.line_counts}
+        stats = {}
+        for converter in converters:
+            for group, names in (converter.metrics_stats() or {}).items():
+                for name, values in names.items():
+                    total = stats.setdefault(group, {}).setdefault(name, {'calls': 0, 'seconds': 0})
+                    total['calls'] += values['calls']
+                    total['seconds'] += values['seconds']
+
+        result = ['# HELP {}_lines_total Processed lines by class'.format(prefix),
+                  '# TYPE {}_lines_total counter'.format(prefix)]
+        result += ['{}_lines_total{{class="{}"}} {}'.format(prefix, line_class, count)
+                   for line_class, count in line_counts.items()]
+
+        reload_stats = self.reload_stats()
+        for name, metric_type, key, description in [
+                ('tables_reloads_total', 'counter', 'reloads', 'Reloads of coefficients'),
+                ('tables_reload_failures_total', 'counter', 'failures', 'Failed reloads of coefficients'),
+                ('tables_last_reload_seconds', 'gauge', 'last_seconds', 'Duration of the last reload'),
+                ('tables_products', 'gauge', 'products', 'Products in the current coefficients')]:
+            full_name = '{}_{}'.format(prefix, name)
+            result += ['# HELP {} {}'.format(full_name, description), '# TYPE {} {}'.format(full_name, metric_type),
+                       '{} {}'.format(full_name, reload_stats[key])]
+
+        for group, names in stats.items():
+            label = 'kind' if group == CONVERSIONS else 'stage'
+            for metric, description in [('calls', 'Number of calls'), ('seconds', 'Total time in seconds')]:
+                full_name = '{}_{}_{}_total'.format(prefix, group, metric)
+                result += ['# HELP {} {} of every {}'.format(full_name, description, label),
+                           '# TYPE {} counter'.format(full_name)]
+                result += ['{}{{{}="{}"}} {}'.format(full_name, label, name, values[metric])
+                           for name, values in names.items()]
+
+        return '\n'.join(result) + '\n'
+
+    @classmethod
+    def set_logger(cls):
+        """Configure 'ARConverter' logger once for all converters (and once more in a forked process).
+        Records are put in a queue and written to the file by a background thread, so logging never
+        blocks conversion. Unknown products are counted by ARConverter.unknown_products"""
+
+        if ARConverter.logger is not None and ARConverter.logger_pid == os.getpid():
+            return ARConverter.logger
 
-    def set_logger(self):
         logger = logging.getLogger('ARConverter')
         logger.setLevel(logging.INFO)
 
+        # The queue and the writing thread of the parent process don't work after fork
+        for handler in list(logger.handlers):
+            if isinstance(handler, QueueHandler):
+                logger.removeHandler(handler)
+
         try:
             os.mkdir('log')
         except FileExistsError:
@@ -57,299 +954,541 @@ class ARConverter:
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+
+        log_queue = queue.Queue()
+        ARConverter.log_listener = QueueListener(log_queue, file_handler)
+        ARConverter.log_listener.start()
+        logger.addHandler(QueueHandler(log_queue))
+
+        ARConverter.logger = logger
+        ARConverter.logger_pid = os.getpid()
+        ARConverter.unknown_products = UnknownProducts(logger)
+
+        # atexit doesn't work in multiprocessing workers, finalizers do
+        atexit.register(cls.stop_logger)
+        util.Finalize(None, cls.stop_logger, exitpriority=0)
 
         return logger
 
+    @classmethod
+    def stop_logger(cls):
+        """Write counted unknown products and all queued records to the log, stop the writing thread
+        and close the log file"""
+
+        if ARConverter.log_listener is None or ARConverter.logger_pid != os.getpid():
+            return
+
+        ARConverter.unknown_products.flush()
+        ARConverter.log_listener.stop()
+
+        for handler in ARConverter.log_listener.handlers:
+            handler.close()
+        for handler in list(ARConverter.logger.handlers):
+            if isinstance(handler, QueueHandler):
+                ARConverter.logger.removeHandler(handler)
+
+        ARConverter.log_listener = None
+        ARConverter.logger_pid = None
+
+    @timed('process_line')
     def process_line(self, line):
         """The main procedure - handles with an initial line, call all procedures and returns lines with replaced
         amounts and measures
 
+        0. Classify the line - lines without amounts and links are only cleaned
         1. Delete all incorrect symbols or replace it with suitable value
         2. Check if the line is a link - we don't need to convert this line
         3. Allocate components in the line such as item, amount, units of measure and their indexes for accurate replacing
         4. Replace amounts and units of measure
+
+        If the cache is enabled, repeated lines are taken from it
         """
 
-        result = self.delete_incorrect_symbols(line)
+        self.refresh_tables()
+
+        line_class = self.classify_line(line)
+        self.line_counts[line_class] += 1
 
-        is_link_templ = 'https|www|\.com'
-        is_link = re.findall(is_link_templ, result)
+        if line_class == PASSTHROUGH and self.is_plain(line):
+            return line.strip()
+        if line_class in (PASSTHROUGH, LINK):
+            return self.delete_incorrect_symbols(line)
 
-        if is_link:
+        if self.cache is not None:
+            result = self.cache.get(line)
+            if result is None:
+                result = self.cache.put(line, self.convert_line(self.delete_incorrect_symbols(line)))
             return result
 
-        components = self.break_line(result)
+        result = self.delete_incorrect_symbols(line)
 
-        if len(components['amount'].keys()) > 0:
-            for key in components['amount']:
-                result = self.replace_in_line(result, key, components)
-        return result
+        return self.convert_line(result)
 
-    def replace_in_line(self, line, amount, components):
-        """Call different functions for replacing repeated amount in line and single ones"""
+    @timed('process_lines')
+    def process_lines(self, lines):
+        """Batch version of process_line - handles with a list of lines and returns a list of converted lines.
+        Symbols and emojis are deleted from all the lines at once, and the kinds of words (units, ingredients, etc.)
+        are detected once for the whole batch. Lines should not contain line breaks.
+        If the cache is enabled, repeated lines are taken from it and are not cleaned at all"""
 
-        if len(components['index'][amount]) > 1:
-            result = self.replace_repeated_amount(line, amount, components)
-        else:
-            sub_dict = self.get_sub_dict_for_amount(amount, components)
-            result = self.replace_not_repeated_amount(line, sub_dict, components)
+        self.refresh_tables()
+
+        word_kinds = {}
+        classes = [self.classify_line(line) for line in lines]
+
+        # Lines which are ready without cleaning - plain ones and the cached ones, None for the rest
+        ready = []
+        for line, line_class in zip(lines, classes):
+            if line_class == PASSTHROUGH and self.is_plain(line):
+                ready.append(line.strip())
+            elif line_class not in (PASSTHROUGH, LINK) and self.cache is not None:
+                ready.append(self.cache.get(line))
+            else:
+                ready.append(None)
+
+        cleaned = iter(self.clean_lines([line for line, result in zip(lines, ready) if result is None]))
+        result = []
+        to_convert = []
+
+        for line, line_class, ready_line in zip(lines, classes, ready):
+            self.line_counts[line_class] += 1
+
+            if ready_line is not None:
+                result.append(ready_line)
+            elif line_class in (PASSTHROUGH, LINK):
+                result.append(next(cleaned))
+            elif self.vectorize:
+                to_convert.append(len(result))
+                result.append(next(cleaned))
+            else:
+                result.append(self.convert_line(next(cleaned), word_kinds))
+
+        if to_convert:
+            converted = self.convert_lines([result[i] for i in to_convert], word_kinds)
+            for i, line in zip(to_convert, converted):
+                result[i] = line
+
+        if self.cache is not None:
+            for line, line_class, ready_line, converted in zip(lines, classes, ready, result):
+                if ready_line is None and line_class not in (PASSTHROUGH, LINK):
+                    self.cache.put(line, converted)
 
         return result
 
-    def replace_not_repeated_amount(self, line, sub_dict, components):
-        """Replace amount and unit measure in the line according to given subdictionary. Handles all units -
-        from Fahrenheit degrees to volume, weight, and inches"""
+    def process_text(self, text):
+        """Convert a whole recipe - text with several lines, and return converted text"""
 
-        result = line
-        amount_index = sub_dict.get('index')
-        measure_index = sub_dict.get('index_m')
-        measure = sub_dict.get('measure')
-        possible_fahrenheit = sub_dict.get('possible_F')
-        all_indexes = components.get('index')
+        return '\n'.join(self.process_lines(text.split('\n')))
 
-        if possible_fahrenheit:
+    def iter_lines(self, lines, batch_size=64):
+        """Lazily convert lines from any iterable of lines - an open text file for example.
+        Lines are read and converted by batches of batch_size lines, so memory doesn't depend on the size
+        of the input. Line breaks at the end of the lines are kept"""
 
-            old_measure = sub_dict.get('old_measure')
-            if old_measure in ['c', 'C']:
-                result = self.update_farenheits(result, sub_dict, all_indexes, warning=True)
+        lines = iter(lines)
 
-            if not measure:
-                result = self.update_farenheits(result, sub_dict, all_indexes)
+        while True:
+            batch = list(islice(lines, batch_size))
+            if not batch:
+                return
 
-            return result
+            endings = [line[len(line.rstrip('\r\n')):] for line in batch]
+            converted = self.process_lines([line.rstrip('\r\n') for line in batch])
+
+            for line, ending in zip(converted, endings):
+                yield line + ending
+
+    def convert_file(self, input_file, output_file, batch_size=64):
+        """Convert all lines from input_file and write them straight to output_file.
+        Return number of converted lines"""
+
+        count = 0
+
+        for line in self.iter_lines(input_file, batch_size):
+            output_file.write(line)
+            count += 1
+
+        return count
+
+    def classify_line(self, line):
+        """Cheap check of a raw line before the conversion. Return one of the classes:
+        - PASSTHROUGH - there are no digits or fractions, nothing to convert
+        - LINK - the line is a link
+        - TEMPERATURE_ONLY - there are amounts and degrees or Fahrenheit/Celsius, but no units of measure
+        - CONVERT - everything else goes through the whole conversion
+        TEMPERATURE_ONLY is only a label for line_stats - such lines are converted as CONVERT ones.
+        They are cheap anyway: break_line doesn't look for the product in lines without units of measure"""
+
+        if not AMOUNT_SIGN_PATTERN.search(line):
+            return PASSTHROUGH
+
+        if LINK_PATTERN.search(line):
+            return LINK
+
+        if UNIT_SIGN_PATTERN.search(line):
+            return CONVERT
+
+        temperature = '°' in line
+
+        for word in WORD_PATTERN.findall(line):
+            if self.find_unit(word):
+                return CONVERT
+            temperature = temperature or self.find_temperature(word) is not None
+
+        return TEMPERATURE_ONLY if temperature else CONVERT
+
+    @staticmethod
+    def is_plain(line):
+        """Check if delete_incorrect_symbols would only strip the line - there are no special symbols and emojis"""
+
+        return line.isascii() and not any(key in line for key, _ in ASCII_SYMBOL_REPLACEMENTS)
+
+    def convert_line(self, line, word_kinds=None):
+        """Convert a line which is already cleaned from incorrect symbols (steps 2-4 of process_line).
+        word_kinds - optional dictionary to share detected kinds of words between lines"""
+
+        edits = self.plan_line(line, word_kinds)
+
+        return edits.apply() if edits is not None else line
+
+    @timed('convert_lines')
+    def convert_lines(self, lines, word_kinds=None):
+        """Batch version of convert_line. Edits of all the lines are planned first, then all their amounts
+        are converted at once by NumberBatch and the results are put in the lines"""
+
+        self.numbers = NumberBatch()
+        try:
+            planned = [self.plan_line(line, word_kinds) for line in lines]
+            self.numbers.calculate()
+
+            return [self.numbers.fill(edits).apply() if edits is not None else line
+                    for line, edits in zip(lines, planned)]
+        finally:
+            self.numbers = None
+
+    def plan_line(self, line, word_kinds=None):
+        """Find components of the line and plan replacements of its amounts.
+        Return LineEdits or None if there is nothing to replace"""
+
+        if LINK_PATTERN.search(line):
+            return None
+
+        components = self.break_line(line, word_kinds)
+
+        if not components.quantities:
+            return None
+
+        edits = LineEdits(line)
+        for quantity in components.quantities:
+            self.replace_in_line(edits, quantity, components)
+
+        return edits
+
+    @timed('replace_in_line')
+    def replace_in_line(self, edits, quantity, components):
+        """Plan replacement of the quantity and its unit measure in the line.
+        Time of the conversion is recorded in self.metrics under its kind, see plan_conversion"""
+
+        if self.metrics is None:
+            self.plan_conversion(edits, quantity, components)
+            return edits
+
+        start = time.perf_counter()
+        kind = self.plan_conversion(edits, quantity, components)
+
+        if kind is not None:
+            self.metrics.record(CONVERSIONS, kind, time.perf_counter() - start)
+
+        return edits
+
+    def plan_conversion(self, edits, quantity, components):
+        """Handles all units - from Fahrenheit degrees to volume, weight, and inches.
+        Return the kind of the conversion (see Metrics) or None if nothing is converted"""
+
+        measure = quantity.unit
+        kind = None
+
+        if quantity.fahrenheit:
+
+            if quantity.unit_text in ['c', 'C'] or not measure:
+                self.update_farenheits(edits, quantity, components)
+                kind = 'celsius_warning' if self.is_celsius_mistake(components.words) else 'fahrenheit'
+
+            return kind
 
         if measure:
 
             if measure == 'cup':
-                result = self.convert_cups_grams(result, sub_dict, all_indexes)
+                self.convert_cups_grams(edits, quantity, components)
 
             elif measure == 'oz':
-                result = self.convert_oz_grams(result, sub_dict, all_indexes)
+                self.convert_oz_grams(edits, quantity, components)
 
             elif measure == 'lb':
-                result = self.convert_lb_grams(result, sub_dict, all_indexes)
+                self.convert_lb_grams(edits, quantity, components)
 
             elif measure in self.ml_measures.keys():
 
-                result = self.convert_ml_gr(result, sub_dict, all_indexes)
+                self.convert_ml_gr(edits, quantity, components)
 
             elif measure == 'inch':
-                result = self.convert_inches_cm(result, sub_dict, all_indexes)
+                self.convert_inches_cm(edits, quantity, components)
 
-            elif sub_dict.get('old_measure'):
+            else:
 
-                result = self.replace_words(result, sub_dict['old_amount'], str(sub_dict['amount']), all_indexes,
-                                            amount_index)
+                self.replace_words(edits, quantity.text, str(quantity.value), quantity.span)
 
-                result = self.replace_words(result, sub_dict['old_measure'], sub_dict['measure'], all_indexes,
-                                            measure_index)
-        amount = sub_dict.get('amount')
-        possible_inch = components.get('possible_inch')
+                self.replace_words(edits, quantity.unit_text, measure, quantity.unit_span)
 
-        for key in possible_inch:
-            if self.is_number_in_line(amount, key) and not measure:
-                result = self.inch_warning(result, possible_inch)
+                return None
 
-        return result
+            return measure if measure in ('cup', 'oz', 'lb', 'inch') else 'ml'
 
-    def replace_repeated_amount(self, line, amount, components):
-        """Get several different subdictionaries for repeated amounts, and replace all amounts
-        and unit measures one by one"""
+        possible_inch = components.possible_inch
 
-        result = line
+        for key in possible_inch:
+            if possible_inch[key] and self.is_number_in_line(str(quantity.value), key):
+                self.inch_warning(edits, possible_inch)
+                kind = 'inch_warning'
 
-        for i in range(len(components['index'][amount])):
-            sub_dict = self.get_sub_dict_for_amount(amount, components, i)
-            result = self.replace_not_repeated_amount(result, sub_dict, components)
-        return result
+        return kind
 
+    @timed('delete_incorrect_symbols')
     def delete_incorrect_symbols(self, line):
         """Replace or delete special symbols from the line. Such as ½ or °
         For reasons of consistency."""
 
-        symbols_to_replace = {'⅛': '1/8', '½': '1/2', '⅓': '1/3', '¼': '1/4', '⅔': '2/3', '¾': '3/4', '°': '', '″': 'inch',
-                              "''": 'inch', '×': 'x', '–': '-'}
-        for key, value in symbols_to_replace.items():
-            line = line.replace(key, ' ' + value).strip()
+        line = self.replace_symbols(line)
         line = self.deEmojify(line)
 
         return line
 
+    @timed('clean_lines')
+    def clean_lines(self, lines):
+        """Delete incorrect symbols and emojis from all the lines at once - the same as delete_incorrect_symbols
+        for every line, but goes through the whole text only once for every symbol"""
+
+        text = self.normalize_symbols('\n'.join(lines))
+        text = '\n'.join(line.strip() for line in text.split('\n'))
+
+        return self.deEmojify(text).split('\n')
+
+    def replace_symbols(self, line):
+        """Replace special symbols with suitable values"""
+
+        return self.normalize_symbols(line).strip()
+
+    @staticmethod
+    def normalize_symbols(text):
+        """Replace all symbols from SYMBOLS_TO_REPLACE and SYMBOLS_TO_NORMALIZE in the text.
+        str.replace returns the same string if there is no such symbol, so absent symbols cost only a search"""
+
+        for key, value in ASCII_SYMBOL_REPLACEMENTS if text.isascii() else SYMBOL_REPLACEMENTS:
+            text = text.replace(key, value)
+
+        return text
+
     def deEmojify(self, line):
-        """Delete all emojis from the line - JSON can't handle them and throw an error"""
+        """Delete all emojis from the line - JSON can't handle them and throw an error.
+        Emojis are found by their codepoints, see EMOJI_RANGES"""
 
-        line = demoji.replace(line)
+        if line.isascii():
+            return line
 
-        return line
+        return EMOJI_PATTERN.sub('', line)
 
-    def break_line(self, line):
-        """Allocate amount, measure, indexes, item and another metrics and words in the line"""
+    @timed('break_line')
+    def break_line(self, line, word_kinds=None):
+        """Allocate quantities with their units of measure and positions, item and words in the line.
+        The line is scanned only once - all the components are built from its token stream. Return ParsedLine"""
 
-        result = {}
+        tokens = self.tokenize(line, word_kinds)
 
-        numbers = self.find_and_check_numbers(line)
-        result.update(numbers)
+        quantities, possible_inch = self.find_and_check_numbers(line, tokens)
 
-        words = self.find_words(line)
-        result.update(words)
+        # The product is needed only to convert units of measure to grams
+        words = self.find_words(line, tokens, any(token.kind == UNIT for token in tokens))
 
-        return result
+        # Every amount measures the nearest product after it ('2 cups sugar and 2 cups flour'),
+        # or the product of the whole line if there is no product after it ('sugar 1 cup')
+        for quantity in quantities:
+            quantity.item, quantity.variant = next(((item, variant) for start, item, variant in words['products']
+                                                    if start >= quantity.span[1]), (words['item'], words['variant']))
 
-    def find_words(self, line):
-        """"Find all words in a line, and check if there is an item"""
+        return ParsedLine(quantities, possible_inch, words['item'], words['variant'], words['words'])
 
-        result = {'item': '', 'words': ''}
+    def tokenize(self, line, word_kinds=None):
+        """Scan the line once and split it into typed tokens with their positions.
+        Numbers (with fractional part or not), range signs ('-', '+') and words -
+        words are classified as range words, units, temperature words, ingredients or plain words.
+        word_kinds - optional dictionary to remember kinds of already classified words"""
 
-        words = re.findall(r'[A-Za-z]+', line)
-        for word in words:
+        tokens = []
 
-            # Check if the word is an ingredient
-            if word.lower() in self.coefficients:
-                result.update({'item': word.lower()})
+        for match in TOKEN_PATTERN.finditer(line):
+            text = match.group()
+            kind = match.lastgroup
 
-        result.update({'words': words})
-        return result
+            if kind == 'number':
+                kind = FRACTION if '/' in text else NUMBER
+            elif kind == 'sign':
+                kind = RANGE
+            elif word_kinds is None:
+                kind = self.classify_word(text)
+            else:
+                kind = word_kinds.get(text)
+                if kind is None:
+                    kind = word_kinds[text] = self.classify_word(text)
 
-    def find_and_check_numbers(self, line):
-        """Find all numbers in a line and check words around them to detect a unit measure.
-        Take care of double amounts such as '4-5 cups / 1 to 2 oz' to convert and replace them differently"""
+            tokens.append(Token(kind, text, match.start(), match.end()))
 
-        number_dict = {'amount': {}, 'measure': {}, 'old_measure': {},
-                       'possible_F': {}, 'index': {}, 'possible_inch':{}}
-        double_amounts = self.find_double_numbers(line, number_dict)
+        return tokens
 
-        self.check_for_single_amount(line, number_dict)
+    def classify_word(self, word):
+        """Define the kind of a word token"""
 
-        if len(double_amounts) > 0:
-            self.handle_double_amount(number_dict, double_amounts)
+        if word.lower() in self.range_words:
+            return RANGE
 
-        return number_dict
+        if self.find_unit(word):
+            return UNIT
 
-    def check_for_single_amount(self, line, number_dict):
-        """Find single amounts in the line, their indexes for accurate replacing, units of measures and if they
-        are temperature degrees in Fahrenheit."""
+        if self.find_temperature(word):
+            return TEMPERATURE
 
-        amounts = self.find_numbers(line)
+        if word.lower() in self.coefficients:
+            return INGREDIENT
 
-        if len(amounts) > 0:
-            for amount in amounts:
-                amount = amount.strip()
-                template = '(?<![\d/.,]){}(?![/.])'.format(amount)
-                self.find_position(amount, line, number_dict, template)
-                convert_amount = self.str_to_int_convert_amount(amount)
+        return WORD
 
-                number_dict['amount'].update({amount: convert_amount})
+    def find_words(self, line, tokens=None, find_item=True):
+        """"Find all words in a line, and check if there is an item - the longest product name in the line.
+        Save its variant as well, and all the products of the line as (position, item, variant) in 'products'.
+        With find_item=False only the words are found"""
 
-                self.check_possible_fahrenheit(amount, convert_amount, number_dict)
-                self.look_around_number(line, amount, number_dict)
+        tokens = self.tokenize(line) if tokens is None else tokens
+        result = {'item': '', 'variant': '', 'words': '', 'products': []}
 
+        word_tokens = [token for token in tokens if token.text.isalpha()]
+        words = [token.text for token in word_tokens]
 
-        return
+        # Check if there is an ingredient
+        if find_item:
+            found = self.ingredients.match_all([word.lower() for word in words])
+            ingredient = self.ingredients.longest(found)
 
-    def handle_double_amount(self, number_dict, double_amounts):
-        """Copy subdictionary for amounts in two numbers ('4-5 cups', '4 to 5 cups' )
-        to convert and replace both numbers with appropriate values"""
+            if ingredient:
+                result.update({'item': ingredient[0], 'variant': ingredient[1]})
+            result['products'] = [(word_tokens[start].start, item, variant) for start, length, item, variant in found]
 
-        for d_amount in double_amounts:
-            amounts = self.find_numbers(d_amount)
-            for amount in amounts:
-                if self.get_sub_dict_for_amount(amount, number_dict).get('measure'):
-                    self.copy_sub_dict(amount, amounts, number_dict)
+        result.update({'words': words})
+        return result
 
-        return
+    def find_and_check_numbers(self, line, tokens=None):
+        """Find all numbers in a line and check words around them to detect a unit measure.
+        Take care of double amounts such as '4-5 cups / 1 to 2 oz' to convert and replace them differently.
+        Return a list of Quantity and possible inches"""
 
-    def find_position(self, word, line, number_dict, template='', simple=False):
-        """Find position (index) of a word in the line. Use a custom template if needed"""
+        tokens = self.tokenize(line) if tokens is None else tokens
+        possible_inch = {}
+        double_amounts = self.find_double_numbers(line, possible_inch, tokens)
 
-        if template == '':
-            template = word
+        quantities = self.check_for_single_amount(line, tokens)
 
-        pre_positions = re.finditer(template, line)
-        try:
-            positions = [(pos.start(0), pos.end(0)) for pos in pre_positions]
-            if simple:
-                return positions
-            number_dict['index'].update({word: positions})
-        except:
-            if simple:
-                return (0, len((line)))
-            number_dict['index'].update({word: (0, len(line))})
-        return
+        if len(double_amounts) > 0:
+            self.handle_double_amount(quantities, double_amounts)
 
-    def copy_sub_dict(self, full_amount, amounts, number_dict):
-        """Copy sub dictionary from one amount to another - used in the case when we have amount with 2 numbers
-        for example '4 - 5 cups'  here we have to convert '4 cups' and '5 cups' with respect to the item
-        """
+        return quantities, possible_inch
 
-        if len(set(amounts)) == 1:
-            for i in range(len(amounts)-1):
-                measure = number_dict['measure'][full_amount]
-                old_measure = number_dict['old_measure'][full_amount]
-                number_dict['measure'][full_amount].append(measure[0])
-                number_dict['old_measure'][full_amount].append(old_measure[0])
-                return
+    def check_for_single_amount(self, line, tokens=None):
+        """Find single amounts in the line - every number is a separate Quantity with its position,
+        unit of measure and if it is temperature degrees in Fahrenheit."""
+
+        tokens = self.tokenize(line) if tokens is None else tokens
+
+        return [self.look_around_number(line, i, tokens) for i, token in enumerate(tokens)
+                if token.kind in (NUMBER, FRACTION)]
+
+    def handle_double_amount(self, quantities, double_amounts):
+        """Share the unit measure between all numbers of double amounts ('4-5 cups', '4 to 5 cups')
+        to convert and replace both numbers with appropriate values. double_amounts - (start, end) positions"""
 
+        for start, end in double_amounts:
+            members = [quantity for quantity in quantities if start <= quantity.span[0] and quantity.span[1] <= end]
+            measured = next((quantity for quantity in members if quantity.unit), None)
 
-        for key in number_dict['amount']:
-            if key in amounts:
-                measure_full_amount = number_dict['measure'].get(full_amount)
-                old_measure_full_amount = number_dict['old_measure'].get(full_amount)
-                number_dict['measure'].update({key: measure_full_amount})
-                number_dict['old_measure'].update({key: old_measure_full_amount})
+            for quantity in members:
+                quantity.range = (start, end)
+                if measured:
+                    quantity.unit, quantity.unit_text, quantity.unit_span = (measured.unit, measured.unit_text,
+                                                                             measured.unit_span)
 
         return
 
-    def find_double_numbers(self, line, number_dict):
-        """Find numbers which go in pairs ex: '4 to 5 cups' """
+    @timed('find_double_numbers')
+    def find_double_numbers(self, line, possible_inch, tokens=None):
+        """Find numbers which go in pairs ex: '4 to 5 cups'. Return their (start, end) positions"""
 
-        amounts = self.find_numbers(line)
+        tokens = self.tokenize(line) if tokens is None else tokens
         m_amounts = []
 
-        if len(amounts) >= 2:
-            split_words = ['to', '-', 'x', '\+']
-            for s_word in split_words:
-                m_amounts += self.find_multiple_amount(s_word, amounts, line, number_dict)
+        for s_word in self.range_words:
+            m_amounts += self.find_multiple_amount(s_word, tokens, line, possible_inch)
 
         return m_amounts
 
-    def find_multiple_amount(self, s_word, amounts, line, number_dict):
-        """Looking for triple and double amounts in the line"""
+    def find_multiple_amount(self, s_word, tokens, line, possible_inch):
+        """Looking for triple and double amounts in the line - numbers divided by the same range word.
+        Amounts divided by 'x' (9x13) are saved as possible inches"""
 
         multiple_amounts = []
         i = 0
 
-        if len(amounts) >= 3:
-            while i < len(amounts)-2:
-                triple_pattern = r'{}\s*{}\s*{}\s*{}\s*{}'.format(amounts[i], s_word, amounts[i + 1], s_word, amounts[i + 2])
-                m_amount = re.findall(triple_pattern, line)
-                multiple_amounts += m_amount
-                i += 1
-                if len(m_amount) > 0:
-                    amounts = amounts[0:i-1] + amounts[i+2:]
-                    i = 0
-
-        if len(amounts) == 2:
-            i = 0
-            while i < len(amounts)-1:
-                double_pattern = r'{}\s*{}\s*{}'.format(amounts[i], s_word, amounts[i + 1])
-                m_amount = re.findall(double_pattern, line)
-                multiple_amounts += m_amount
+        while i < len(tokens) - 2:
+            length = self.multiple_amount_length(s_word, tokens, i, line)
+
+            if length:
+                multiple_amounts.append((tokens[i].start, tokens[i + length - 1].end))
+                i += length
+            else:
                 i += 1
-                if len(m_amount) > 0:
-                    amounts = amounts[0:i-1] + amounts[i+1:]
-                    i = 0
-        if s_word == 'x' and len(multiple_amounts) > 0:
-            number_dict['possible_inch'].update({key: True for key in multiple_amounts})
+
+        if s_word == 'x':
+            possible_inch.update({line[start:end]: True for start, end in multiple_amounts})
 
         return multiple_amounts
 
+    def multiple_amount_length(self, s_word, tokens, start, line):
+        """Count tokens in a triple (5 tokens) or double (3 tokens) amount starting from the given token.
+        Return 0 if there is no multiple amount"""
+
+        length = 0
+
+        for end in (start + 4, start + 2):
+            if end >= len(tokens):
+                continue
+
+            for i in range(start, end + 1):
+                if i % 2 == start % 2:
+                    is_part = tokens[i].kind in (NUMBER, FRACTION)
+                else:
+                    is_part = tokens[i].text == s_word
+
+                if not is_part or (i > start and line[tokens[i - 1].end:tokens[i].start].strip()):
+                    break
+            else:
+                length = end - start + 1
+                break
+
+        return length
+
     def find_numbers(self, line, templates=None):
         """Find numbers using regexp.
         Search whole numbers, numbers with fractional part with '/', and real numbers with '.' or ',' as a separator
         """
 
-        templates = templates or ['\d+[.,]\d+|\d*[ ]*\d+[/]\d+|\d+']
+        if templates is None:
+            return AMOUNT_PATTERN.findall(line)
 
         for template in templates:
             amounts = re.findall(r'{}'.format(template), line)
@@ -359,143 +1498,126 @@ class ARConverter:
 
         return []
 
-    def look_around_number(self, line, amount, number_dict):
-        """Find words around a number and check if they are unit measures"""
+    @timed('look_around_number')
+    def look_around_number(self, line, position, tokens=None):
+        """Make Quantity for the number token at the position. Find words around the number
+        and check if they are unit measures or Fahrenheit words. Percents ('2% milk') have no unit,
+        and a unit before the number is skipped if it is the unit of the previous number ('1 cup 2 tbsp')"""
 
-        p_s = ['', '-']
+        tokens = self.tokenize(line) if tokens is None else tokens
+        token = tokens[position]
 
-        left_words = []
-        right_words = []
+        quantity = Quantity(token.text, self.str_to_int_convert_amount(token.text), (token.start, token.end))
 
-        for symbol in p_s:
+        if line[token.end:].lstrip().startswith('%'):
+            return quantity
 
-            left_pattern = r'([a-zA-Z]*[ {}]*)'.format(symbol) + amount + '(?![/\d,.])'
-            right_pattern = r'(?<![\d/.,])' + amount + '[ {}]*([a-zA-Z]+)'.format(symbol)
+        quantity.fahrenheit = self.check_possible_fahrenheit(quantity.value)
 
-            left_word = re.findall(left_pattern, line)
-            right_word = re.findall(right_pattern, line)
+        for step in (-1, 1):
+            word = self.find_word_next_to_number(line, tokens, position, step)
+            if word is None or step < 0 and self.is_after_number(line, tokens, tokens.index(word)):
+                continue
 
-            left_words += left_word
-            right_words += right_word
+            measure = self.find_unit(word.text)
+            if measure and not quantity.unit:
+                quantity.unit, quantity.unit_text, quantity.unit_span = measure, word.text, (word.start, word.end)
 
-        words = self.process_words_around_number(left_words + right_words, p_s)
+            if self.find_temperature(word.text) == 'fahrenheit':
+                quantity.fahrenheit = True
 
-        self.check_words_around_number(words, amount, number_dict, line)
+        return quantity
 
-        return words
+    def find_word_next_to_number(self, line, tokens, position, step):
+        """Return a word token which goes right before (step=-1) or after (step=1) the number,
+        separated from it only by spaces or dashes. Return None if there is no such word"""
 
-    def process_words_around_number(self, words: list, symbols_for_delete: list):
-        """Delete all excess symbols from words, repeated or empty words"""
+        i = position + step
 
-        result = []
-        for word in words:
-            for symbol in symbols_for_delete:
-                word = word.replace(symbol, '')
+        while 0 <= i < len(tokens) and tokens[i].text == '-':
+            i += step
 
-            word = word.strip()
-            if word not in result and word != '':
-                result.append(word)
+        if not 0 <= i < len(tokens) or not tokens[i].text.isalpha():
+            return None
 
+        between = line[tokens[position].end:tokens[i].start] if step > 0 else line[tokens[i].end:tokens[position].start]
 
-        return result
+        if between.strip(' -'):
+            return None
 
-    def check_words_around_number(self, words, amount, number_dict, line):
-        """Check whether words around number are units of measure or Fahrenheit words"""
+        return tokens[i]
 
-        # Check if a word is measure
+    def is_after_number(self, line, tokens, position):
+        """Check if the word token at the position goes right after a number, separated from it
+        only by spaces or dashes"""
 
-        for word in words:
-            word = word.strip()
-            for i in range(len(self.units)):
-                if word.lower() in self.units[i]:
-                    measure = self.units[i][0]
-                    if number_dict['measure'].get(amount) and word not in number_dict['old_measure'][amount]:
-                        number_dict['measure'][amount].append(measure)
-                        number_dict['old_measure'][amount].append(word)
-                    else:
-                        number_dict['measure'][amount] = [measure]
-                        number_dict['old_measure'][amount] = [word]
-
-                    template = r'(?=[ \d-]*){}|(?<=[ \d-]){}'.format(word, word)
-                    self.find_position(word, line, number_dict, template)
-                    break
-
-
-        # Check if word is Fahrenheit word
-            if word.lower() in self.fahrenheit_names:
-                number_dict['possible_F'].update({amount: True})
+        i = position - 1
 
+        while i >= 0 and tokens[i].text == '-':
+            i -= 1
 
-        return
+        return i >= 0 and tokens[i].kind in (NUMBER, FRACTION) and \
+            not line[tokens[i].end:tokens[position].start].strip(' -')
 
-    def cups_grams(self, item, cups, words):
+    def cups_grams(self, item, cups, words, variant=None):
         """Try to convert item from cups to grams if it is in self.coefficients
         dictionary. If everything went correct return new measure and TRUE flag.
         If item is not in dictionary - return input amount of cups and FALSE flag
+        variant - the variant of the item if it is already found
         """
 
-        item_in_coefficients = self.coefficients.get(item)
+        coefficient = self.find_coefficient(item, words, variant)
 
-        if item_in_coefficients:
-            grams = self.calculate_grams_if_item(item, cups, words)
-            return [grams, True]
+        if coefficient is not None:
+            return [coefficient * cups, True]
         else:
-            message = 'INVALID PRODUCT: ' + ' '.join(words)
-            self.logger.info(message)
             return [cups, False]
 
-    def calculate_grams_if_item(self, item, cups, words):
-        """Check if the item could be 2 words name - Brown Sugar - if so, check
-        for the second word in [words] - and try to find an appropriate coefficient
-        if fail -  use {'': coefficient} in subdictionary.
-        """
+    def find_coefficient(self, item, words, variant=None):
+        """Return grams in 1 cup of the item, or None if the item is not in self.coefficients dictionary -
+        then the product is counted as unknown. See IngredientMatcher.coefficient"""
 
-        if type(self.coefficients[item]) == dict:
-            if len(words) > 0:
-                for spec in words:
-                    spec_in_dic = self.coefficients[item].get(spec)
-                    if spec_in_dic:
-                        grams = self.coefficients[item][spec] * cups
-                        break
-                    grams = self.coefficients[item][''] * cups
-            else:
-                grams = self.coefficients[item][''] * cups
+        coefficient = self.ingredients.coefficient(item, words, variant)
 
-        else:
-            grams = self.coefficients[item] * cups
+        if coefficient:
+            return coefficient
 
-        return grams
+        self.unknown_products.add(self.get_product_name(words), ' '.join(words))
+        return None
 
+    def get_product_name(self, words):
+        """Guess the name of an unknown product - all words in the line except units and temperature words"""
 
-    def update_farenheits(self, line, sub_dict, all_indexes, warning=False):
-        """Convert amount from F to C and replace Fahrenheit word in the line.
-        Show warning if the amount is too high and there is a Celsius word nearby"""
+        product = [word.lower() for word in words if self.classify_word(word) in (WORD, INGREDIENT)]
 
-        words = sub_dict.get('words')
-        old_amount = sub_dict['amount']
-        index = sub_dict['index']
+        return ' '.join(product)
 
-        amount = self.fahrenheit_celsius(old_amount)
-        result = self.replace_words(line, str(old_amount), str(amount) + ' °C.', all_indexes, index)
-        convert = False
 
-        for word in words:
-            if word.lower() in self.fahrenheit_names:
-                template = '[ \d-]{}[ ]'.format(word)
-                index = self.find_position(word, result, sub_dict, template, simple=True)
-                result = self.replace_words(result, word, '', all_indexes, index)
-                convert = True
-
-        if not convert:
-            for word in words:
-                if word.lower() in self.celsius_names:
-                    key = '(Possible mistake! {} - too much to be in Celsius. {}F = {}C)'.format(old_amount, old_amount,
-                                                                                                 amount)
-                    result = line + ' ' + key
+    def update_farenheits(self, edits, quantity, components, warning=False):
+        """Convert amount from F to C and plan replacement of Fahrenheit words in the line.
+        Show warning instead if the amount is too high and there is a Celsius word nearby"""
 
-        return result
+        words = components.words
+        old_amount = quantity.value
+
+        amount = self.convert_number(CELSIUS, old_amount)
+
+        if self.is_celsius_mistake(words):
+            key = '(Possible mistake! {} - too much to be in Celsius. {}F = {}C)'.format(old_amount, old_amount,
+                                                                                         amount)
+            edits.append(' ' + key)
+            return edits
 
-    def inch_warning(self, line, possible_inches):
+        fahrenheit_words = [word for word in words if self.find_temperature(word) == 'fahrenheit']
+
+        self.replace_words(edits, quantity.text, amount + ' °C.', quantity.span)
+
+        for word in fahrenheit_words:
+            edits.replace(word, '', whole_word=True)
+
+        return edits
+
+    def inch_warning(self, edits, possible_inches):
         """If unit measure is not specify and there is a possibility we have inches there,
         show a warning message and convert all amounts in cm after the line,
         don't replace it in the line"""
@@ -510,100 +1632,100 @@ class ARConverter:
                 assert len(a) >= 2, 'wrong amount: {}'.format(key)
                 for value in a:
                     value = self.str_to_int_convert_amount(value)
-                    cm = self.in_cm(value)
                     inch_list.append(str(value))
-                    cm_list.append(str(cm))
+                    cm_list.append(self.convert_number(CENTIMETERS, value))
                 converted.append('x'.join(inch_list) + ' in. = ' + 'x'.join(cm_list) + ' cm')
 
                 possible_inches.update({key: False})
 
         if len(converted) == 0:
-            return line
+            return edits
 
-        result = line + '(measures might be in inches: ' + ', '.join(converted) + ')'
+        edits.append('(measures might be in inches: ' + ', '.join(converted) + ')')
 
-        return result
+        return edits
 
     # High-level conversion functions
 
-    def convert_cups_grams(self, line, sub_dict, all_indexes):
-        """Converts cups to grams and process result whether the conversion is succeed or failed"""
-
-        result = line
-        index = sub_dict['index']
-        index_m = sub_dict['index_m']
+    def convert_cups_grams(self, edits, quantity, components, cups=None):
+        """Converts cups to grams and process result whether the conversion is succeed or failed.
+        cups - amount in cups if it differs from the quantity (converted from another volume)"""
 
-        old_amount = sub_dict['old_amount']
+        cups = quantity.value if cups is None else cups
 
-        cups_to_grams = self.cups_grams(sub_dict['item'], sub_dict['amount'], sub_dict['words'])
-        new_amount = str(round(cups_to_grams[0]))
+        coefficient = self.find_coefficient(quantity.item, components.words, quantity.variant)
 
-        if cups_to_grams[1]:  # if conversion is success
-            result = self.replace_words(result, old_amount, new_amount, all_indexes, index)
+        if coefficient is not None:  # if conversion is success
+            new_amount = self.convert_number(GRAMS, cups, coefficient)
+            self.replace_words(edits, quantity.text, new_amount, quantity.span)
 
-            result = self.replace_words(result, sub_dict['old_measure'], 'grams', all_indexes, index_m)
+            self.replace_words(edits, quantity.unit_text, 'grams', quantity.unit_span)
 
-        return result
+        return edits
 
-    def convert_ml_gr(self, line, sub_dict, all_indexes):
+    def convert_ml_gr(self, edits, quantity, components):
         """Calculates proportion for volume in self.ml_measures and converts cups to grams"""
 
-        cups_in_measure = self.ml_cups(sub_dict['measure'])
-        cups = sub_dict['amount']*cups_in_measure
-        sub_dict.update({'amount': cups})
+        cups_in_measure = self.ml_cups(quantity.unit)
+        cups = quantity.value*cups_in_measure
 
-        result = self.convert_cups_grams(line, sub_dict, all_indexes)
-
-        return result
+        return self.convert_cups_grams(edits, quantity, components, cups)
 
-    def convert_oz_grams(self, line, sub_dict, all_indexes):
+    def convert_oz_grams(self, edits, quantity, components):
         """Convert oz to grams and replace it in the line"""
 
-        index = sub_dict.get('index')
-        index_m = sub_dict.get('index_m')
+        grams = self.convert_number(GRAMS, quantity.value, GRAMS_IN_OZ)
+        self.replace_words(edits, quantity.text, grams, quantity.span)
 
-        grams = self.oz_grams(sub_dict['amount'])
-        result = self.replace_words(line, sub_dict['old_amount'], str(grams), all_indexes, index)
+        self.replace_words(edits, quantity.unit_text, 'grams', quantity.unit_span)
 
-        result = self.replace_words(result, sub_dict['old_measure'], 'grams', all_indexes, index_m)
+        return edits
 
-        return result
-
-    def convert_lb_grams(self, line, sub_dict, all_indexes):
+    def convert_lb_grams(self, edits, quantity, components):
         """Convert lb to grams and replace it in the line"""
 
-        index = sub_dict.get('index')
-        index_m = sub_dict.get('index_m')
-
-        grams = self.lb_grams(sub_dict['amount'])
-        result = self.replace_words(line, str(sub_dict['old_amount']), str(grams), all_indexes, index)
+        grams = self.convert_number(GRAMS, quantity.value, GRAMS_IN_LB)
+        self.replace_words(edits, quantity.text, grams, quantity.span)
 
-        result = self.replace_words(result, sub_dict['old_measure'], 'grams', all_indexes, index_m)
+        self.replace_words(edits, quantity.unit_text, 'grams', quantity.unit_span)
 
-        return result
+        return edits
 
-    def convert_inches_cm(self, line, sub_dict, all_indexes):
+    def convert_inches_cm(self, edits, quantity, components):
         """Convert inches to cm, replace in the line"""
 
-        index = sub_dict.get('index')
-        index_m = sub_dict.get('index_m')
-
-        cm = self.in_cm(sub_dict['amount'])
-        result = self.replace_words(line, str(sub_dict['old_amount']), str(cm), all_indexes, index)
-        result = self.replace_words(result, sub_dict['old_measure'], 'cm', all_indexes, index_m)
+        cm = self.convert_number(CENTIMETERS, quantity.value)
+        self.replace_words(edits, quantity.text, cm, quantity.span)
+        self.replace_words(edits, quantity.unit_text, 'cm', quantity.unit_span)
 
-        return result
+        return edits
 
     # Simple one-line additional functions
 
+    def is_celsius_mistake(self, words):
+        """Check if a high temperature is written in Celsius - there is a Celsius word and no Fahrenheit words"""
+
+        kinds = [self.find_temperature(word) for word in words]
+
+        return 'fahrenheit' not in kinds and 'celsius' in kinds
+
+    def convert_number(self, kind, value, factor=1):
+        """Convert the amount (see NumberBatch.convert) and return it as a string for the line.
+        In convert_lines return a placeholder instead - the amounts of the batch are converted together"""
+
+        if self.numbers is not None:
+            return self.numbers.add(kind, value, factor)
+
+        return str(NumberBatch.convert(kind, value, factor))
+
     def fahrenheit_celsius(self, temperature):
-        return round((temperature - 32)*5/9)
+        return NumberBatch.convert(CELSIUS, temperature)
 
     def oz_grams(self, weight):
-        return round(weight*28.35)
+        return NumberBatch.convert(GRAMS, weight, GRAMS_IN_OZ)
 
     def lb_grams(self, weight):
-        return round(weight*453.6)
+        return NumberBatch.convert(GRAMS, weight, GRAMS_IN_LB)
 
     def ml_cups(self, measure):
         """Calculates coefficient(proportion) for volume measures to cups"""
@@ -615,12 +1737,7 @@ class ARConverter:
     def in_cm(self, inches):
         """Calculates centimeters from inches. If result is small - round it to 2 decimal places"""
 
-        result = inches*2.54
-
-        if result <= 5:
-            return round(result, 2)
-
-        return round(result)
+        return NumberBatch.convert(CENTIMETERS, inches)
 
     # Auxiliary functions
     def str_to_int_convert_amount(self, amount):
@@ -657,110 +1774,23 @@ class ARConverter:
                 result += int(string_numbers[i])
         return result
 
-    def get_sub_dict_for_amount(self, amount, whole_dict, index=0):
-        """Extract sub dictionary for the particular amount as a key value in all sub dictionaries
-        For example, we have such a dictionary {'amount': {'1 1/2': 1.5, '350': 350}, 'measure': {'1 1/2': 'cup'},
-                                                                                        'F_word':{'350': 'F'}}
-        for amount = '1 1/2' this function extract dictionary {'old_amount': '1 1/2', 'amount': 1.5, 'measure': 'cup'}
-        for amount = '350' it should be {'old_amount': 350, 'amount': 350, 'F_word': 'F'}
-
-        """
-
-        result = {}
-        result.update({'old_amount': amount})
-
-        try:
-            measure = whole_dict['old_measure'].get(amount)
-            if measure:
-                if index < len(measure):
-                    measure = measure[index]
-                    result.update({'index_m': whole_dict['index'].get(measure)})
-
-        except KeyError:
-            pass
-
-        for key in whole_dict:
-            try:
-                am_in_keys = whole_dict[key].get(amount)
-                if am_in_keys != None:
-                    if type(am_in_keys) == list:
-                        if index < len(whole_dict[key][amount]):
-                            result.update({key: whole_dict[key][amount][index]})
-                    else:
-                        result.update({key: whole_dict[key][amount]})
-
-
-            except AttributeError:
-                result.update({key: whole_dict[key]})
-
-        return result
-
-    def check_possible_fahrenheit(self, amount, convert_amount, number_dict):
+    def check_possible_fahrenheit(self, amount):
         """We consider a number as a possible fahrenheit if it's larger than 270 (because recipes with this temperature
         are quite rare)"""
 
-        if convert_amount > 270:
-            number_dict['possible_F'].update({amount: True})
-        else:
-            number_dict['possible_F'].update({amount: False})
-            return
-
-    def replace_words(self, line, what, to_what, all_indexes, args=None):
-        """Replace words in line in respect with start and end positions for searching"""
-        if type(args) == tuple:
-            start = args[0]
-            end = args[1]
+        return amount > 270
 
-        elif type(args) == list and len(args) > 0:
+    def replace_words(self, edits, what, to_what, span=None):
+        """Plan replacement of a word in the line at the given (start, end) position, or of its first occurrence.
+        Positions are indexes in the original line - they don't change after other replacements"""
 
-        #Remove indexes from used args, in case there are more than 1 arg with the same value
+        start, end = span or (0, None)
 
-            first = args[0]
-            args.remove(first)
-            start = first[0]
-            end = first[1]
+        edits.replace(what, to_what, start, end, whole_word=True)
 
-        else:
-            pre_index = re.finditer(what, line)
-            try:
-                indexes = [(pos.start(0), pos.end(0)) for pos in pre_index]
-                start = indexes[0][0]
-                end = indexes[0][1]
-
-            except:
-                result = line.replace(what, to_what)
-                return result
-
-        result = line[:start] + line[start:end].replace(what, to_what) + line[end:]
-        self.update_all_indexes_after_replacement(what, to_what, start, end, all_indexes)
-
-        return result
-
-    def update_all_indexes_after_replacement(self, old, new, start, end, all_indexes):
-        """Updates all indexes for a line"""
-
-        for key in all_indexes:
-            for value in all_indexes[key]:
-                if value[0] >= start and value[1] > end:
-                    v_index = all_indexes[key].index(value)
-                    new_index = self.get_new_index(old, new, value)
-                    all_indexes[key][v_index] = new_index
-        pass
-
-    def get_new_index(self, old, new, index):
-        """Updates particular given index as a tuple"""
-
-        shift = len(str(new)) - len(str(old))
-        new_index = index[0] + shift, index[1] + shift
-
-        return new_index
+        return edits
 
     def is_number_in_line(self, amount, string):
         """Check if the given multiple number exist in line after all replacement"""
 
-        pattern = r'(?<![\d/.,])\s*{}\s*[^\d/]'.format(amount)
-        match = re.findall(pattern, string)
-        if len(match) > 0:
-            return True
-
-        return False
\ No newline at end of file
+        return amount in NUMBER_PATTERN.findall(string)
\ No newline at end of file
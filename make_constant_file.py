@@ -5,30 +5,52 @@ key = item, value = grams in 1 cup, separated by ':' symbol
 for multi-word items it should be the main initial item - for example, for 'Brown Sugar'
 we have to have single 'Sugar' and it will look like
 sugar:{'': 200, 'brown': 220}
+
+Besides JSON file it compiles coefficients.marshal - the lookup tables ARConverter needs at runtime
+(the ingredient trie and the flat (product, variant) index), which are loaded much faster than JSON
 """
 
 import re
+import os
+import sys
 import json
-from os.path import join, dirname
+import marshal
+import tempfile
+from os.path import join, dirname, abspath
+
+COEFFICIENTS_FILE = 'coefficients.json'
+COMPILED_FILE = 'coefficients.marshal'
+COMPILED_VERSION = 3
 
 
 class MeasurementsFileMaker():
 
-    def __init__(self, path):
+    def __init__(self, path, write=True):
         self.multi_coefficients = []
         self.dic_coefficients = {}
+        self.index = None
 
-        self.path = join(dirname(__file__), path)
+        self.path = join(dirname(abspath(__file__)), path)
 
-        self.make_measurements_file()
+        if write:
+            self.make_measurements_file()
+        else:
+            self.make_coefficients()
 
     def make_measurements_file(self):
-        """Make coefficients and write it in the coefficients.json file"""
+        """Make coefficients and write it in the coefficients.json file and the compiled file
+        next to the measurements file"""
 
         self.make_coefficients()
+        self.write_files()
+
+    def write_files(self):
+        file_dir = dirname(self.path)
 
-        with open('coefficients.json', 'w+') as coefficient:
-            json.dump(self.dic_coefficients, coefficient)
+        replace_file(join(file_dir, COEFFICIENTS_FILE),
+                     lambda coefficient: json.dump(self.dic_coefficients, coefficient))
+
+        compile_coefficients(self.dic_coefficients, join(file_dir, COMPILED_FILE), self.index)
 
     def make_coefficients(self):
         """Read measurements.txt file with raw messy input of coefficients,
@@ -44,6 +66,7 @@ class MeasurementsFileMaker():
         measurements_file.close()
 
         self.process_multi_coefficients()
+        self.index = make_coefficient_index(self.dic_coefficients)
 
     def process_line(self, line):
         """Divide a line for words and numbers. If there are more than one word, save this item to
@@ -100,4 +123,85 @@ class MeasurementsFileMaker():
         pass
 
 
-start = MeasurementsFileMaker('measurements.txt')
+def make_coefficient_index(coefficients):
+    """Flatten coefficients for lookups of grams. Return (index, variants):
+    - index - {(product, variant): grams in 1 cup}, variant '' is the default coefficient of the product
+    - variants - {product: frozenset of one-word variants} to intersect with words of a line
+    Products are named as in coefficients, variants are in lower case with words joined by spaces -
+    'all-purpose' is 'all purpose'"""
+
+    index = {}
+    variants = {}
+
+    for product, value in coefficients.items():
+        if type(value) != dict:
+            index.setdefault((product, ''), value)
+            continue
+
+        words = set()
+        for variant, coefficient in value.items():
+            variant = ' '.join(re.findall(r'[a-z]+', variant.lower()))
+            index.setdefault((product, variant), coefficient)
+            if coefficient and variant and ' ' not in variant:
+                words.add(variant)
+
+        variants[product] = frozenset(words)
+
+    return index, variants
+
+
+def compile_coefficients(coefficients, path, index=None):
+    """Write coefficients, the ingredient trie and the flat index (made if not given) built from them
+    in a marshal file. The file is replaced atomically, so readers never see a half-written file"""
+
+    from converter import IngredientMatcher
+
+    matcher = IngredientMatcher(coefficients, index=index or make_coefficient_index(coefficients))
+    tables = {'version': COMPILED_VERSION, 'python': tuple(sys.version_info[:2]), 'coefficients': coefficients,
+              'ingredients': matcher.root, 'index': matcher.index, 'variants': matcher.variants}
+
+    replace_file(path, lambda compiled: marshal.dump(tables, compiled), 'wb')
+
+    return tables
+
+
+def replace_file(path, write, mode='w'):
+    """Write the file with write(file) to a temporary file with a unique name next to it and replace
+    the file atomically. Readers never see a half-written file, and processes writing the same file
+    at the same time don't overwrite each other's temporary files"""
+
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                     dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, mode) as temp_file:
+            write(temp_file)
+        # mkstemp makes the file readable only by the owner
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_compiled_coefficients(path):
+    """Read tables from the compiled file. Return None if the file is missing, broken or
+    made by another version of this module or Python"""
+
+    try:
+        with open(path, 'rb') as compiled:
+            tables = marshal.loads(compiled.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if type(tables) != dict or tables.get('version') != COMPILED_VERSION or \
+            tables.get('python') != tuple(sys.version_info[:2]):
+        return None
+
+    return tables
+
+
+if __name__ == '__main__':
+    start = MeasurementsFileMaker('measurements.txt')
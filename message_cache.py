@@ -0,0 +1,126 @@
+"""
+Answers of recent messages of the bot, line by line. When a user edits a recipe to fix one line,
+only the changed lines are converted and translated again, and the bot edits its earlier reply
+instead of sending a new one.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class CachedMessage:
+    """Reply of the bot to a message: id of the reply, answer text and {line of the message: line of the answer}"""
+
+    __slots__ = ('reply_id', 'answer', 'lines')
+
+    def __init__(self):
+        self.reply_id = None
+        self.answer = None
+        self.lines = {}
+
+
+class MessageCache:
+    """Answers of messages by (chat id, message id). Keeps up to size messages - the least recently used
+    are deleted. Counts reused and converted lines"""
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.messages = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.reused = 0
+        self.converted = 0
+
+    def get(self, chat_id, message_id):
+        """Return CachedMessage or None if the message is unknown"""
+
+        with self.lock:
+            message = self.messages.get((chat_id, message_id))
+            if message is not None:
+                self.messages.move_to_end((chat_id, message_id))
+
+            return message
+
+    def missing(self, chat_id, message_id, lines):
+        """Return lines which have no answer yet - all the lines of a new message or changed lines of an edited one.
+        Every line is returned only once"""
+
+        message = self.get(chat_id, message_id)
+        answered = message.lines if message is not None else {}
+
+        return list(dict.fromkeys(line for line in lines if line not in answered))
+
+    def put(self, chat_id, message_id, lines, answers):
+        """Save answers ({line: answer line}) for the new lines of the message and return the whole answer.
+        Answers of lines which are not in the message anymore are deleted. Return None and save nothing
+        if some lines have no answer - the message was deleted from the cache after missing was called"""
+
+        with self.lock:
+            message = self.messages.get((chat_id, message_id)) or CachedMessage()
+
+            old_lines = message.lines
+            if any(line not in answers and line not in old_lines for line in lines):
+                return None
+
+            self.messages.pop((chat_id, message_id), None)
+            message.lines = {line: answers[line] if line in answers else old_lines[line] for line in lines}
+            message.answer = '\n'.join(message.lines[line] for line in lines)
+
+            self.converted += len(answers)
+            self.reused += len(message.lines) - len(answers)
+
+            self.messages[(chat_id, message_id)] = message
+            if len(self.messages) > self.size:
+                self.messages.popitem(last=False)
+
+            return message.answer
+
+    def set_reply(self, chat_id, message_id, reply_id):
+        message = self.get(chat_id, message_id)
+        if message is not None:
+            message.reply_id = reply_id
+
+    def answer(self, chat_id, message_id, text, answer_lines):
+        """Answer the message reusing answers of its unchanged lines. answer_lines(lines) returns
+        answer lines for the list of lines. Return the answer, id of the earlier reply (None for a new message)
+        and if the answer differs from the earlier one"""
+
+        lines = text.split('\n')
+        previous = self.get(chat_id, message_id)
+        previous_answer = previous.answer if previous is not None else None
+
+        answers = {}
+        missing = self.missing(chat_id, message_id, lines)
+
+        while True:
+            if missing:
+                answers.update(zip(missing, answer_lines(missing)))
+
+            answer = self.put(chat_id, message_id, lines, answers)
+            if answer is not None:
+                break
+
+            # The message was deleted from the cache while its lines were answered - answer the rest too
+            missing = self.missing(chat_id, message_id, [line for line in lines if line not in answers])
+
+        reply_id = previous.reply_id if previous is not None else None
+        if reply_id is not None:
+            self.set_reply(chat_id, message_id, reply_id)
+
+        return answer, reply_id, answer != previous_answer
+
+    def reply(self, chat_id, message_id, text, answer_lines, send, edit):
+        """Answer the message and send the answer with send(chat_id, text), which returns id of the sent message.
+        If the message was edited, edit the earlier reply with edit(chat_id, reply_id, text) instead"""
+
+        answer, reply_id, changed = self.answer(chat_id, message_id, text, answer_lines)
+
+        if reply_id is None:
+            self.set_reply(chat_id, message_id, send(chat_id, answer))
+        elif changed:
+            edit(chat_id, reply_id, answer)
+
+        return answer
+
+    def __len__(self):
+        return len(self.messages)
@@ -0,0 +1,220 @@
+"""
+Fair scheduler of messages for the bot. Every chat has its own bounded queue, a fixed pool of worker threads
+takes messages from the chats in turn (round-robin), so one user sending dozens of huge recipes doesn't starve
+the others. Messages of one chat are handled one by one in their order. When the queue of the chat or all
+the queues are full, a message is rejected and the user gets a reply about it.
+If handle returns a Future (e.g. of AsyncPipeline.submit), the worker is free at once and the chat waits
+for the next message until the future is done.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values, 0 for no values"""
+
+    if not values:
+        return 0
+
+    index = max(0, min(len(values) - 1, int(round(percent / 100 * len(values))) - 1))
+    return values[index]
+
+
+class ChatScheduler:
+
+    def __init__(self, handle, workers=4, chat_size=5, total_size=1000, reject=None, recent_waits=1000):
+        """
+        - handle(chat_id, item) handles one message, reject(chat_id, item) answers a rejected one -
+        both are blocking, handle runs in the workers, reject - in the thread which submits the message.
+        handle could return a concurrent.futures.Future instead of waiting for the message to be handled -
+        then the next message of the chat is handled when the future is done
+        - workers - number of worker threads
+        - chat_size - how many messages of one chat could wait, total_size - of all chats
+        - recent_waits - how many last wait times are kept for percentiles
+        """
+
+        self.handle = handle
+        self.reject = reject
+        self.chat_size = chat_size
+        self.total_size = total_size
+
+        # chat_id -> deque of (item, time of submit). Chats in self.ready wait for a worker,
+        # chats with queues but not in self.ready are handled right now
+        self.queues = {}
+        self.ready = deque()
+        self.pending = 0
+        self.active = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waits = deque(maxlen=recent_waits)
+
+        self.threads = [threading.Thread(target=self.work, name='ChatScheduler-{}'.format(i), daemon=True)
+                        for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Handle all waiting messages and stop the workers"""
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join()
+
+        # Messages handled by futures are still in progress
+        with self.condition:
+            while self.active:
+                self.condition.wait()
+
+    def submit(self, chat_id, item):
+        """Put the message in the queue of the chat. Return False if it's rejected"""
+
+        with self.condition:
+            chat_queue = self.queues.get(chat_id)
+            accepted = not self.stopped and self.pending < self.total_size and \
+                (chat_queue is None or len(chat_queue) < self.chat_size)
+
+            if accepted:
+                if chat_queue is None:
+                    chat_queue = self.queues[chat_id] = deque()
+                    self.ready.append(chat_id)
+
+                chat_queue.append((item, time.monotonic()))
+                self.pending += 1
+                self.submitted += 1
+                self.condition.notify()
+            else:
+                self.rejected += 1
+
+        if not accepted and self.reject is not None:
+            self.reject(chat_id, item)
+
+        return accepted
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.ready and not (self.stopped and self.pending == 0):
+                    self.condition.wait()
+
+                if not self.ready:
+                    return
+
+                chat_id = self.ready.popleft()
+                item, submitted = self.queues[chat_id].popleft()
+                self.pending -= 1
+                self.active += 1
+
+                wait = time.monotonic() - submitted
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+                self.waits.append(wait)
+
+                if self.stopped and self.pending == 0:
+                    self.condition.notify_all()
+
+            try:
+                result = self.handle(chat_id, item)
+            except Exception:
+                logger.exception('Failed to handle a message from chat %s', chat_id)
+                self.finish(chat_id, True)
+                continue
+
+            if isinstance(result, Future):
+                result.add_done_callback(lambda future, chat_id=chat_id: self.done(chat_id, future))
+            else:
+                self.finish(chat_id, False)
+
+    def done(self, chat_id, future):
+        """Done-callback of a future returned by handle"""
+
+        failed = future.cancelled() or future.exception() is not None
+        if failed:
+            logger.error('Failed to handle a message from chat %s', chat_id,
+                         exc_info=None if future.cancelled() else future.exception())
+
+        self.finish(chat_id, failed)
+
+    def finish(self, chat_id, failed):
+        with self.condition:
+            self.active -= 1
+            self.processed += 1
+            self.failed += failed
+
+            # The chat goes to the end of the line if it has more messages
+            if self.queues[chat_id]:
+                self.ready.append(chat_id)
+            else:
+                del self.queues[chat_id]
+            self.condition.notify_all()
+
+    def stats(self):
+        """Return queue depth, counters of messages and wait times (in seconds) from submit to a worker"""
+
+        with self.condition:
+            waits = sorted(self.waits)
+            started = self.processed + self.active
+
+            return {'workers': len(self.threads),
+                    'queued': self.pending,
+                    'active': self.active,
+                    'chats': len(self.queues),
+                    'max_chat_queue': max((len(chat_queue) for chat_queue in self.queues.values()), default=0),
+                    'submitted': self.submitted,
+                    'processed': self.processed,
+                    'rejected': self.rejected,
+                    'failed': self.failed,
+                    'wait_total': self.wait_total,
+                    'wait_avg': self.wait_total / started if started else 0,
+                    'wait_max': self.wait_max,
+                    'wait_p50': percentile(waits, 50),
+                    'wait_p90': percentile(waits, 90),
+                    'wait_p99': percentile(waits, 99)}
+
+    def export_metrics(self, prefix='bot_scheduler'):
+        """Return the stats in Prometheus text exposition format"""
+
+        stats = self.stats()
+        result = []
+
+        for name, metric_type, description in [('workers', 'gauge', 'Number of workers'),
+                                               ('queued', 'gauge', 'Messages waiting in the queues'),
+                                               ('active', 'gauge', 'Messages handled right now'),
+                                               ('chats', 'gauge', 'Chats with waiting or handled messages'),
+                                               ('max_chat_queue', 'gauge', 'The longest queue of a chat'),
+                                               ('submitted', 'counter', 'Accepted messages'),
+                                               ('processed', 'counter', 'Handled messages'),
+                                               ('rejected', 'counter', 'Rejected messages'),
+                                               ('failed', 'counter', 'Messages failed with an error')]:
+            full_name = '{}_{}{}'.format(prefix, name, '_total' if metric_type == 'counter' else '')
+            result += ['# HELP {} {}'.format(full_name, description), '# TYPE {} {}'.format(full_name, metric_type),
+                       '{} {}'.format(full_name, stats[name])]
+
+        full_name = '{}_wait_seconds'.format(prefix)
+        result += ['# HELP {} Time from submit to a worker, quantiles of recent messages'.format(full_name),
+                   '# TYPE {} summary'.format(full_name)]
+        result += ['{}{{quantile="{}"}} {}'.format(full_name, quantile, stats['wait_p{}'.format(percent)])
+                   for quantile, percent in [('0.5', 50), ('0.9', 90), ('0.99', 99)]]
+        result += ['{}_sum {}'.format(full_name, stats['wait_total']),
+                   '{}_count {}'.format(full_name, stats['processed'] + stats['active'])]
+
+        return '\n'.join(result) + '\n'
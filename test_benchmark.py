@@ -0,0 +1,61 @@
+import io
+import os
+import json
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from benchmark import RecipeGenerator, measure, compare, print_results, main
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_generator(self):
+        generator = RecipeGenerator(seed=1)
+
+        self.assertEqual(generator.lines('mixed', 20), RecipeGenerator(seed=1).lines('mixed', 20))
+        self.assertTrue(all(line.startswith('https://') for line in generator.lines('links', 10)))
+        self.assertTrue(all(' to ' in line or '-' in line for line in generator.lines('ranges', 10)))
+        self.assertIn('brown sugar', generator.products)
+
+    def test_measure(self):
+        result = measure(RecipeGenerator().lines('mixed', 50), repeat=1)
+
+        self.assertEqual(result['lines'], 50)
+        self.assertTrue(result['p50_us'] <= result['p90_us'] <= result['p99_us'] <= result['max_us'])
+        self.assertGreater(result['lines_per_sec'], 0)
+        self.assertGreater(result['peak_memory_kib'], 0)
+
+    def test_compare(self):
+        baseline = {'results': {'ranges': {'lines_per_sec': 1000, 'batch_lines_per_sec': 1000}}}
+        results = {'results': {'ranges': {'lines_per_sec': 800, 'batch_lines_per_sec': 950},
+                               'links': {'lines_per_sec': 10, 'batch_lines_per_sec': 10}}}
+
+        self.assertEqual(compare(results, baseline), [('ranges', 'lines_per_sec', 1000, 800, -0.2)])
+        self.assertEqual(compare(results, baseline, threshold=0.3), [])
+
+    def test_print_results(self):
+        result = dict.fromkeys(['lines_per_sec', 'batch_lines_per_sec', 'p50_us', 'p90_us', 'p99_us', 'max_us',
+                                'peak_memory_kib'], 100)
+        baseline = {'results': {'links': dict(result, lines_per_sec=50)}}
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            print_results({'results': {'links': result}}, baseline)
+
+        self.assertIn('100 (+100%)', output.getvalue().split('\n')[1])
+
+    def test_save_baseline(self):
+        with tempfile.TemporaryDirectory() as file_dir:
+            baseline = os.path.join(file_dir, 'baseline.json')
+            args = ['--scenarios', 'pans', 'links', '--lines', '20', '--repeat', '1', '--baseline', baseline]
+
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(main(args + ['--save']), 0)
+                main(args + ['--compare', '--threshold', '1'])
+
+            with open(baseline) as baseline_file:
+                self.assertEqual(list(json.load(baseline_file)['results']), ['pans', 'links'])
+
+
+unittest.main()
@@ -0,0 +1,89 @@
+import time
+import threading
+import unittest
+
+import bot_pipeline
+from bot_pipeline import AsyncPipeline
+from message_cache import MessageCache
+
+
+class TestAsyncPipeline(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.sent = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def translate(self, text):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+        time.sleep(0.05)
+
+        with self.lock:
+            self.running -= 1
+
+        return text.upper()
+
+    def send(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+    def test_concurrent_messages(self):
+        pipeline = AsyncPipeline(self.translate, self.send, concurrency=4, processes=0).start()
+
+        start = time.monotonic()
+        futures = [pipeline.submit(chat_id, '1 c milk') for chat_id in range(8)]
+        answers = [future.result(timeout=5) for future in futures]
+        duration = time.monotonic() - start
+        pipeline.stop()
+
+        self.assertEqual(answers, ['244 GRAMS MILK'] * 8)
+        self.assertEqual(sorted(self.sent), [(chat_id, '244 GRAMS MILK') for chat_id in range(8)])
+        self.assertEqual(self.max_running, 4)
+        self.assertLess(duration, 0.05 * 8)
+
+    def test_edited_message(self):
+        edited = []
+        translated = []
+
+        def send(chat_id, text):
+            self.send(chat_id, text)
+            return len(self.sent)
+
+        def translate(text):
+            translated.append(text)
+            return text.upper()
+
+        pipeline = AsyncPipeline(translate, send, concurrency=2, processes=0,
+                                 edit=lambda *args: edited.append(args), message_cache=MessageCache()).start()
+
+        pipeline.submit(1, '1 c milk\nMix well', message_id=5).result(timeout=5)
+        answer = pipeline.submit(1, '1 oz milk\nMix well', message_id=5).result(timeout=5)
+        pipeline.stop()
+
+        self.assertEqual(answer, '28 GRAMS MILK\nMIX WELL')
+        self.assertEqual(self.sent, [(1, '244 GRAMS MILK\nMIX WELL')])
+        self.assertEqual(edited, [(1, 1, '28 GRAMS MILK\nMIX WELL')])
+        self.assertEqual(translated, ['244 grams milk\nMix well', '28 grams milk'])
+
+    def test_converter_cache(self):
+        pipeline = AsyncPipeline(self.translate, self.send, concurrency=1, processes=0).start()
+
+        pipeline.submit(1, '1 c milk\nMix well').result(timeout=5)
+        hits = bot_pipeline.converter.cache_stats()['hits']
+        pipeline.submit(2, '1 c milk\nMix well').result(timeout=5)
+        pipeline.stop()
+
+        self.assertEqual(bot_pipeline.converter.cache_stats()['hits'], hits + 1)
+
+    def test_worker_processes(self):
+        pipeline = AsyncPipeline(self.translate, self.send, concurrency=2, processes=2).start()
+
+        future = pipeline.submit(1, '1 oz milk\nMix well')
+        self.assertEqual(future.result(timeout=30), '28 GRAMS MILK\nMIX WELL')
+        pipeline.stop()
+
+
+unittest.main()
@@ -0,0 +1,52 @@
+import io
+import json
+import unittest
+
+import bulk_convert
+from bulk_convert import convert_file
+
+
+class TestBulkConvert(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.lines = ['1 c milk', 'Preheat oven to 450°', '', '1 oz milk', '1 tsp soda'] * 5
+        self.converted = ['244 grams milk', 'Preheat oven to 232 °C.', '', '28 grams milk', '1 tsp soda'] * 5
+
+    def test_convert_file_text(self):
+        for workers in [1, 2]:
+            output_file = io.StringIO()
+            convert_file(io.StringIO('\n'.join(self.lines) + '\n'), output_file, workers=workers, chunk_size=3)
+
+            self.assertEqual(output_file.getvalue().split('\n')[:-1], self.converted)
+
+    def test_convert_file_jsonl(self):
+        records = [{'id': i, 'text': '\n'.join(self.lines[i:i + 3])} for i in range(10)] + ['1 c milk']
+        input_file = io.StringIO('\n'.join(json.dumps(record) for record in records))
+        output_file = io.StringIO()
+
+        convert_file(input_file, output_file, file_format='jsonl', workers=2, chunk_size=4)
+        result = [json.loads(line) for line in output_file.getvalue().splitlines()]
+
+        self.assertEqual([record['id'] for record in result[:-1]], list(range(10)))
+        self.assertEqual(result[1]['text'], '\n'.join(self.converted[1:4]))
+        self.assertEqual(result[-1], '244 grams milk')
+
+    def test_convert_file_other_records(self):
+        records = [[1, 2], None, 5, {'id': 1}, {'text': 5}, '1 c milk']
+        input_file = io.StringIO('\n'.join(json.dumps(record) for record in records))
+        output_file = io.StringIO()
+
+        convert_file(input_file, output_file, file_format='jsonl', workers=2, chunk_size=2)
+        result = [json.loads(line) for line in output_file.getvalue().splitlines()]
+
+        self.assertEqual(result, records[:-1] + ['244 grams milk'])
+
+    def test_convert_file_cache(self):
+        output_file = io.StringIO()
+        convert_file(io.StringIO('\n'.join(self.lines) + '\n'), output_file, workers=1, chunk_size=5, cache_size=10)
+
+        self.assertEqual(output_file.getvalue().split('\n')[:-1], self.converted)
+        self.assertEqual(bulk_convert.converter.cache_stats()['hits'], 16)
+
+
+unittest.main()
@@ -1,13 +1,19 @@
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
 import unittest
 
-from converter import ARConverter
+from converter import ARConverter, LineEdits, NumberBatch, CELSIUS, GRAMS, CENTIMETERS
 
 
 class TestTemperatureConvert(unittest.TestCase):
 
     def setUp(self) -> None:
         self.my_converter = ARConverter()
-        self.number_dict = {'amount': {}, 'measure': {}, 'old_measure': {}, 'F_word': {}, 'possible_F': {}, 'index': {}}
         self.words = ['cup', 'all', 'purpose', 'flour']
 
     def test_str_to_int_convert_amount_complete(self):
@@ -92,6 +98,302 @@ class TestTemperatureConvert(unittest.TestCase):
         for i in range(len(test_lines)):
             self.assertEqual(self.my_converter.process_line(test_lines[i]), result_lines[i])
 
+    def test_process_text(self):
+        text = '¼ cup milk\nPreheat oven to 450°\n\nhttps://www.recipes.com/1-cup-milk\n1 oz milk'
+        result = self.my_converter.process_text(text)
+        lines = [self.my_converter.process_line(line) for line in text.split('\n')]
+
+        self.assertEqual(result, '\n'.join(lines))
+        self.assertEqual(self.my_converter.process_lines(['1 c milk', '1 tsp soda', '']), ['244 grams milk', '1 tsp soda', ''])
+
+    def test_iter_lines(self):
+        lines = iter(['1 c milk\n', 'Mix well\r\n', '1 oz milk'])
+        result = self.my_converter.iter_lines(lines, batch_size=2)
+
+        self.assertEqual(next(result), '244 grams milk\n')
+        self.assertEqual(list(result), ['Mix well\r\n', '28 grams milk'])
+
+    def test_convert_file(self):
+        input_file = io.StringIO('1 c milk\n\n1 tsp soda\n')
+        output_file = io.StringIO()
+
+        count = self.my_converter.convert_file(input_file, output_file, batch_size=2)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(output_file.getvalue(), '244 grams milk\n\n1 tsp soda\n')
+
+    def test_register_unit(self):
+        ARConverter.register_unit('dl', ml=100)
+        ARConverter.register_unit('kg')
+
+        try:
+            self.assertEqual(self.my_converter.find_unit('DL'), 'dl')
+            self.assertEqual(self.my_converter.find_unit('Cups'), 'cup')
+            self.assertEqual(self.my_converter.process_line('2 dl milk'), '203 grams milk')
+            self.assertEqual(self.my_converter.process_line('1,5 kg flour'), '1.5 kg flour')
+        finally:
+            del ARConverter.unit_aliases['dl'], ARConverter.unit_aliases['kg'], ARConverter.ml_measures['dl']
+
+    def test_load_tables(self):
+        with tempfile.TemporaryDirectory() as file_dir:
+            shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'measurements.txt'), file_dir)
+
+            coefficients, ingredients = ARConverter.load_tables(file_dir)
+            compiled_path = os.path.join(file_dir, 'coefficients.marshal')
+
+            self.assertEqual(coefficients, self.my_converter.coefficients)
+            self.assertTrue(os.path.exists(os.path.join(file_dir, 'coefficients.json')))
+            self.assertEqual(ingredients.match(['brown', 'sugar']), ('sugar', 'brown'))
+
+            # Compiled file is newer than JSON - it is used as is
+            with open(compiled_path, 'rb') as compiled:
+                data = compiled.read()
+            self.assertEqual(ARConverter.load_tables(file_dir)[0], coefficients)
+            self.assertEqual(ARConverter.load_tables(file_dir)[1].index, ingredients.index)
+
+            # Measurements are newer - everything is rebuilt
+            with open(os.path.join(file_dir, 'measurements.txt'), 'a') as measurements:
+                measurements.write('\nrhubarb, 122\n')
+            os.utime(os.path.join(file_dir, 'measurements.txt'), (time.time() + 10, time.time() + 10))
+
+            self.assertEqual(ARConverter.load_tables(file_dir)[0]['rhubarb'], 122)
+            with open(compiled_path, 'rb') as compiled:
+                self.assertNotEqual(compiled.read(), data)
+
+    def test_concurrent_writes(self):
+        from make_constant_file import MeasurementsFileMaker, load_compiled_coefficients
+
+        with tempfile.TemporaryDirectory() as file_dir:
+            measurements_path = os.path.join(file_dir, 'measurements.txt')
+            shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'measurements.txt'), file_dir)
+            MeasurementsFileMaker(measurements_path)
+
+            # Several processes rebuild the files at the same time, others read them meanwhile
+            writers = [threading.Thread(target=MeasurementsFileMaker, args=(measurements_path,)) for _ in range(8)]
+            for writer in writers:
+                writer.start()
+
+            while any(writer.is_alive() for writer in writers):
+                with open(os.path.join(file_dir, 'coefficients.json')) as coefficients_file:
+                    self.assertEqual(json.load(coefficients_file), self.my_converter.coefficients)
+                self.assertIsNotNone(load_compiled_coefficients(os.path.join(file_dir, 'coefficients.marshal')))
+
+            for writer in writers:
+                writer.join()
+            self.assertEqual(sorted(os.listdir(file_dir)), ['coefficients.json', 'coefficients.marshal',
+                                                            'measurements.txt'])
+
+    def test_coefficient_index(self):
+        ingredients = self.my_converter.ingredients
+
+        self.assertEqual((ingredients.index[('sugar', '')], ingredients.index[('flour', 'all purpose')]), (201, 128))
+        self.assertIn('brown', ingredients.variants['sugar'])
+        self.assertNotIn('old fashion', ingredients.variants['oats'])
+
+        self.assertEqual(ingredients.coefficient('sugar', ['cup', 'Brown', 'sugar']), 220)
+        self.assertEqual(ingredients.coefficient('sugar', ['powdered', 'or', 'brown', 'sugar']), 100)
+        self.assertEqual(ingredients.coefficient('flour', ['flour'], 'all purpose'), 128)
+        self.assertEqual(ingredients.coefficient('sugar', ['brown', 'sugar'], ''), 201)
+        self.assertEqual(ingredients.coefficient('sugar', []), 201)
+        self.assertEqual(ingredients.coefficient('water', ['cold', 'water']), 240)
+        self.assertIsNone(ingredients.coefficient('quinoa', ['quinoa']))
+
+        self.assertEqual(self.my_converter.cups_grams('sugar', 2, ['white', 'sugar']), [402, True])
+        self.assertEqual(self.my_converter.cups_grams('quinoa', 2, ['quinoa']), [2, False])
+
+    def test_reload_tables(self):
+        tables = ARConverter.tables
+        custom_converter = ARConverter()
+        custom_converter.coefficients = {'milk': 100}
+        stats = ARConverter.reload_stats()
+
+        with tempfile.TemporaryDirectory() as file_dir:
+            shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'measurements.txt'), file_dir)
+
+            try:
+                watcher = ARConverter.watch_tables(0.01, file_dir)
+                self.assertIs(ARConverter.watch_tables(), watcher)
+                self.assertEqual(self.my_converter.process_line('1 cup rhubarb'), '1 cup rhubarb')
+
+                with open(os.path.join(file_dir, 'measurements.txt'), 'a') as measurements:
+                    measurements.write('\nrhubarb, 122\n')
+                self.wait_reload(stats['reloads'] + 1)
+
+                self.assertEqual(self.my_converter.process_line('1 cup rhubarb'), '122 grams rhubarb')
+                self.assertEqual(custom_converter.process_line('1 cup milk'), '100 grams milk')
+                self.assertEqual(ARConverter.reload_stats()['products'], len(tables[0]) + 1)
+
+                # Broken coefficients.json newer than measurements - the old tables are kept
+                json_path = os.path.join(file_dir, 'coefficients.json')
+                with open(json_path, 'w') as coefficients_file:
+                    coefficients_file.write('{"rhubarb": ')
+                os.utime(json_path, (time.time() + 10, time.time() + 10))
+                self.wait_reload(stats['reloads'] + 1, stats['failures'] + 1)
+
+                self.assertEqual(self.my_converter.process_line('1 cup rhubarb'), '122 grams rhubarb')
+                self.assertIn('arconverter_tables_reload_failures_total {}'.format(stats['failures'] + 1),
+                              self.my_converter.export_metrics())
+            finally:
+                ARConverter.stop_watching_tables()
+                ARConverter.tables = tables
+
+        self.assertEqual(self.my_converter.process_line('1 cup rhubarb'), '1 cup rhubarb')
+
+    def wait_reload(self, reloads, failures=None):
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            stats = ARConverter.reload_stats()
+            if stats['reloads'] >= reloads and (failures is None or stats['failures'] >= failures):
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(ARConverter.reload_stats()['reloads'], reloads)
+        self.assertGreater(ARConverter.reload_stats()['last_seconds'], 0)
+
+    def test_shared_tables(self):
+        my_converter = ARConverter()
+
+        self.assertIs(my_converter.coefficients, self.my_converter.coefficients)
+        self.assertIs(my_converter.ingredients, self.my_converter.ingredients)
+        self.assertEqual(len(my_converter.logger.handlers), 1)
+
+        with self.assertRaises(TypeError):
+            my_converter.coefficients['milk'] = 100
+        with self.assertRaises(AttributeError):
+            my_converter.units_in_line = []
+
+    def test_stop_logger(self):
+        listener = ARConverter.log_listener
+        ARConverter.stop_logger()
+
+        self.assertIsNone(ARConverter.log_listener)
+        self.assertTrue(all(handler.stream is None for handler in listener.handlers))
+        self.assertEqual(ARConverter.logger.handlers, [])
+
+        self.assertEqual(len(ARConverter().logger.handlers), 1)
+        self.assertIsNotNone(ARConverter.log_listener)
+
+    def test_unknown_products(self):
+        unknown_products = ARConverter.unknown_products
+        unknown_products.flush()
+
+        for line in ['1 cup quinoa', '2 cups Quinoa', '1 cup milk', '1 c dragon fruit']:
+            self.my_converter.process_line(line)
+
+        self.assertEqual(unknown_products.top(), [('quinoa', 2, 'cup quinoa'), ('dragon fruit', 1, 'c dragon fruit')])
+        self.assertEqual(len(unknown_products.flush()), 2)
+        self.assertEqual(unknown_products.top(), [])
+
+    def test_process_line_cache(self):
+        my_converter = ARConverter(cache_size=2)
+
+        for line in ['1 c milk', '1 oz milk', '1 c milk', '1 tsp soda', '1 oz milk']:
+            my_converter.process_line(line)
+
+        self.assertEqual(my_converter.cache_stats(), {'hits': 1, 'misses': 4, 'evictions': 2, 'size': 2})
+        self.assertEqual(my_converter.process_line('1 tsp soda'), '1 tsp soda')
+
+        my_converter.coefficients = dict(my_converter.coefficients, milk=100)
+        self.assertEqual(my_converter.cache_stats()['size'], 0)
+        self.assertEqual(my_converter.process_line('1 c milk'), '100 grams milk')
+        self.assertIsNone(self.my_converter.cache_stats())
+
+    def test_process_lines_cache(self):
+        lines = ['1 c milk', 'Preheat oven to 450°', '', '1 c milk', 'https://www.recipes.com/1-cup-milk']
+        expected = [self.my_converter.process_line(line) for line in lines]
+
+        for vectorize in [False, True]:
+            my_converter = ARConverter(cache_size=10, vectorize=vectorize)
+
+            self.assertEqual(my_converter.process_lines(lines), expected)
+            self.assertEqual(my_converter.process_lines(lines), expected)
+            self.assertEqual(my_converter.cache_stats(), {'hits': 3, 'misses': 3, 'evictions': 0, 'size': 2})
+            self.assertEqual(my_converter.process_line('1 c milk'), expected[0])
+            self.assertEqual(my_converter.cache_stats()['hits'], 4)
+
+    def test_classify_line(self):
+        my_converter = ARConverter()
+
+        self.assertEqual(my_converter.classify_line('Mix well.'), 'passthrough')
+        self.assertEqual(my_converter.classify_line('https://www.example.com/recipe/1'), 'link')
+        self.assertEqual(my_converter.classify_line('Preheat oven to 350°.'), 'temperature')
+        self.assertEqual(my_converter.classify_line('Bake at 350 F for 20 minutes'), 'temperature')
+        self.assertEqual(my_converter.classify_line('½ c milk'), 'convert')
+        self.assertEqual(my_converter.classify_line('Bake at 180 C'), 'convert')
+
+        lines = ['  Mix well.  ', 'Mix well – slowly', 'https://www.example.com/1', '350 F', '1 c milk']
+        self.assertEqual(my_converter.process_lines(lines),
+                         ['Mix well.', 'Mix well  - slowly', 'https://www.example.com/1', '177 °C. ', '244 grams milk'])
+        self.assertEqual([my_converter.process_line(line) for line in lines], my_converter.process_lines(lines))
+        self.assertEqual(my_converter.line_stats(), {'passthrough': 6, 'link': 3, 'temperature': 3, 'convert': 3})
+
+    def test_number_batch(self):
+        # Halves are rounded to even, small centimeters keep 2 decimals, huge amounts stay exact
+        amounts = [(CELSIUS, 350), (CELSIUS, 32.9), (CELSIUS, -320), (GRAMS, 2.5), (GRAMS, 3.5), (GRAMS, 1, 28.35),
+                   (GRAMS, 0.25, 453.6), (GRAMS, 0.75, 201), (CENTIMETERS, 0.25), (CENTIMETERS, 1.968),
+                   (CENTIMETERS, 2), (CENTIMETERS, 13), (GRAMS, 10 ** 20, 28.35), (CELSIUS, 2 ** 60 + 1)]
+        expected = [str(NumberBatch.convert(*amount)) for amount in amounts]
+
+        for vectorized in [True, False]:
+            batch = NumberBatch(vectorized)
+            placeholders = [batch.add(*amount) for amount in amounts]
+            self.assertEqual(batch.calculate(), expected)
+
+            edits = LineEdits('a b')
+            edits.replace('a', placeholders[0] + ' °C.')
+            edits.append(' ({} cm)'.format(placeholders[8]))
+            self.assertEqual(batch.fill(edits).apply(), '177 °C. b (0.64 cm)')
+
+        self.assertEqual(expected[:12], ['177', '0', '-196', '2', '4', '28', '113', '151', '0.64', '5.0', '5', '33'])
+
+    def test_vectorize(self):
+        lines = ['1 c milk', '2-3 oz butter', 'Preheat oven to 350°', '1 1/2 lb beef', 'Mix well', '9x13 pan',
+                 '2 inch slices', '1 1/4 cups all-purpose flour', '3 tbsp sugar', 'Bake at 200 C or 420 F',
+                 '1 egg, 1 cup milk', '½ gallon water', 'https://www.example.com/1 cup']
+
+        self.assertEqual(ARConverter(vectorize=True).process_lines(lines), ARConverter().process_lines(lines))
+        self.assertEqual(ARConverter(vectorize=True).process_lines(lines),
+                         [ARConverter().process_line(line) for line in lines])
+
+    def test_metrics(self):
+        self.assertIsNone(self.my_converter.metrics_stats())
+
+        my_converter = ARConverter(metrics=True)
+        for line in ['1 c milk', '2 oz butter', '1 oz milk', 'Preheat oven to 450°', 'Mix well']:
+            my_converter.process_line(line)
+
+        stats = my_converter.metrics_stats()
+        self.assertEqual(stats['stage']['process_line']['calls'], 5)
+        self.assertEqual(stats['stage']['break_line']['calls'], 4)
+        self.assertEqual({kind: values['calls'] for kind, values in stats['conversion'].items()},
+                         {'cup': 1, 'oz': 2, 'fahrenheit': 1})
+        self.assertGreater(stats['stage']['process_line']['seconds'], 0)
+
+        text = my_converter.export_metrics()
+        self.assertIn('# TYPE arconverter_stage_calls_total counter', text)
+        self.assertIn('arconverter_conversion_calls_total{kind="oz"} 2', text)
+
+        # Every conversion is counted once under its own kind
+        my_converter.metrics.reset()
+        for line in ['1 tbsp milk', 'Use a 9x13 pan', 'Bake at 400 celsius', 'Preheat oven to 450°', '2 lb 8 oz beef']:
+            my_converter.process_line(line)
+
+        self.assertEqual({kind: values['calls'] for kind, values in my_converter.metrics_stats()['conversion'].items()},
+                         {'ml': 1, 'inch_warning': 1, 'celsius_warning': 1, 'fahrenheit': 1, 'lb': 1, 'oz': 1})
+        self.assertIn('arconverter_lines_total{class="passthrough"} 1', text)
+
+        # Counters of several converters are summed
+        other_converter = ARConverter(metrics=True)
+        other_converter.process_line('2 oz butter')
+        text = my_converter.export_metrics(converters=[my_converter, other_converter])
+        self.assertIn('arconverter_conversion_calls_total{kind="oz"} 2', text)
+        self.assertIn('arconverter_lines_total{class="passthrough"} 1', text)
+
+        my_converter.disable_metrics()
+        my_converter.process_line('1 c milk')
+        self.assertIsNone(my_converter.metrics_stats())
+        self.assertNotIn('arconverter_stage', my_converter.export_metrics())
+
     def test_delete_incorrect_symbols(self):
         line1 = self.my_converter.delete_incorrect_symbols('¼ cups all purpose flour')
         line2 = self.my_converter.delete_incorrect_symbols('1½ cups all purpose flour')
@@ -100,6 +402,18 @@ class TestTemperatureConvert(unittest.TestCase):
         self.assertEqual(line2, '1 1/2 cups all purpose flour')
         self.assertEqual(line3, 'Preheat the oven to 350 F')
 
+        line4 = self.my_converter.delete_incorrect_symbols('1⅜ cups and 3⁄4\u00a0tsp – ⅝″')
+        self.assertEqual(line4, '1 3/8 cups and 3/4 tsp  -  5/8 inch')
+        self.assertEqual(self.my_converter.process_line('1\u00a01⁄2 c milk'), '366 grams milk')
+
+    def test_deEmojify(self):
+        line1 = self.my_converter.deEmojify('1 cup 🍓 strawberries 👍🏽')
+        line2 = self.my_converter.deEmojify('1️⃣ Preheat the oven 🇺🇸 ☕️')
+        line3 = self.my_converter.deEmojify('Pan ⌀ 20 cm, ½ cup – 180 ℃')
+        self.assertEqual(line1, '1 cup  strawberries ')
+        self.assertEqual(line2, ' Preheat the oven  ')
+        self.assertEqual(line3, 'Pan ⌀ 20 cm, ½ cup – 180 ℃')
+
     def test_find_numbers(self):
         number1 = self.my_converter.find_numbers('1 16 oz can of lentils')
         number2 = self.my_converter.find_numbers('1 1/2 cup of milk')
@@ -115,22 +429,81 @@ class TestTemperatureConvert(unittest.TestCase):
         self.assertEqual(numbers56, ['1', '8'])
         self.assertEqual(number7, ['1', '3.25'])
 
-    def test_look_around_number(self):
-        words1 = self.my_converter.look_around_number('16 oz can', '16', self.number_dict)
-        words2 = self.my_converter.look_around_number('butter 1 lb', '1', self.number_dict)
-        words3 = self.my_converter.look_around_number('sugar lb 10', '10', self.number_dict)
+    def test_tokenize(self):
+        tokens = self.my_converter.tokenize('4-5 cups brown sugar, 1 1/2 oz')
+        kinds = [(token.kind, token.text) for token in tokens]
+
+        self.assertEqual(kinds, [('number', '4'), ('range', '-'), ('number', '5'), ('unit', 'cups'),
+                                 ('word', 'brown'), ('ingredient', 'sugar'), ('fraction', '1 1/2'), ('unit', 'oz')])
+        self.assertEqual((tokens[6].start, tokens[6].end), (22, 27))
 
-        self.assertEqual(words1, ['oz'])
-        self.assertEqual(words2, ['butter', 'lb'])
-        self.assertEqual(words3, ['lb'])
+    def test_process_line_unit_inside_word(self):
+        line1 = self.my_converter.process_line('Chocolate: 1 c milk')
+        line2 = self.my_converter.process_line('1 1/2 quart milk, 1 1/2 cup milk')
+        self.assertEqual(line1, 'Chocolate: 244 grams milk')
+        self.assertEqual(line2, '1443 grams milk, 366 grams milk')
+
+    def test_find_words(self):
+        words1 = self.my_converter.find_words('1 cup Brown sugar')
+        words2 = self.my_converter.find_words('1 cup chocolate chips, 1 cup milk')
+        words3 = self.my_converter.find_words('2 cups water')
+
+        self.assertEqual((words1['item'], words1['variant']), ('sugar', 'brown'))
+        self.assertEqual((words2['item'], words2['variant']), ('chocolate', 'chips'))
+        self.assertEqual((words3['item'], words3['variant']), ('water', ''))
+        self.assertEqual(self.my_converter.process_line('1 cup all-purpose flour'), '128 grams all-purpose flour')
+
+    def test_look_around_number(self):
+        quantity1 = self.my_converter.look_around_number('16 oz can', 0)
+        quantity2 = self.my_converter.look_around_number('butter 1 lb', 1)
+        quantity3 = self.my_converter.look_around_number('sugar lb 10', 2)
+        quantity4 = self.my_converter.look_around_number('Bake at 180 F', 2)
+
+        self.assertEqual((quantity1.unit, quantity1.unit_text, quantity1.unit_span), ('oz', 'oz', (3, 5)))
+        self.assertEqual((quantity2.value, quantity2.span, quantity2.unit), (1, (7, 8), 'lb'))
+        self.assertEqual((quantity3.unit, quantity3.fahrenheit), ('lb', False))
+        self.assertEqual((quantity4.unit, quantity4.fahrenheit), (None, True))
+
+    def test_process_line_percent(self):
+        line1 = self.my_converter.process_line('2 cups 2% milk')
+        line2 = self.my_converter.process_line('8 oz 70 % dark chocolate')
+        line3 = self.my_converter.process_line('1 cup 2 tbsp butter')
+        self.assertEqual(line1, '488 grams 2% milk')
+        self.assertEqual(line2, '227 grams 70 % dark chocolate')
+        self.assertEqual(line3, '227 grams 28 grams butter')
+        self.assertIsNone(self.my_converter.look_around_number('2 cups 2% milk', 2).unit)
+
+    def test_repeated_amounts(self):
+        components = self.my_converter.break_line('1 egg, 1 cup milk, 2-3 oz butter')
+
+        self.assertEqual([(quantity.text, quantity.unit) for quantity in components.quantities],
+                         [('1', None), ('1', 'cup'), ('2', 'oz'), ('3', 'oz')])
+        self.assertEqual(components.quantities[2].range, (19, 22))
+        self.assertEqual(self.my_converter.process_line('1 egg, 1 cup milk'), '1 egg, 244 grams milk')
+        self.assertEqual(self.my_converter.process_line('2 tbsp milk and 2 cups milk'),
+                         '30 grams milk and 488 grams milk')
+
+    def test_mixed_products(self):
+        components = self.my_converter.break_line('1 cup brown sugar, 1 cup flour')
+
+        self.assertEqual([(quantity.item, quantity.variant) for quantity in components.quantities],
+                         [('sugar', 'brown'), ('flour', '')])
+        self.assertEqual(self.my_converter.process_line('2 cups sugar and 2 cups flour'),
+                         '402 grams sugar and 256 grams flour')
+        self.assertEqual(self.my_converter.process_line('1 cup brown sugar, 1 cup flour'),
+                         '220 grams brown sugar, 128 grams flour')
+        self.assertEqual(self.my_converter.process_line('1 tbsp milk, 1 cup all-purpose flour'),
+                         '15 grams milk, 128 grams all-purpose flour')
+        self.assertEqual(self.my_converter.process_line('sugar 1 cup'), 'sugar 201 grams')
 
     def test_update_farenheits(self):
-        all_indexes = {'350': [(18, 21)]}
-        sub_dict1 = {'old_amount': '350', 'amount': 350, 'possible_F': True, 'index': [(18, 21)], 'item': '', 'words': ['Preheat', 'oven', 'till', 'F']}
-        sub_dict2 = {'old_amount': '350', 'amount': 350, 'possible_F': True, 'index': [(18, 21)], 'item': '', 'words': ['Preheat', 'oven', 'till']}
+        components1 = self.my_converter.break_line('Preheat oven till 350 F')
+        components2 = self.my_converter.break_line('Preheat oven till 350')
 
-        line1 = self.my_converter.update_farenheits('Preheat oven till 350 F', sub_dict1, all_indexes)
-        line2 = self.my_converter.update_farenheits('Preheat oven till 350', sub_dict2, all_indexes)
+        line1 = self.my_converter.update_farenheits(LineEdits('Preheat oven till 350 F'), components1.quantities[0],
+                                                    components1).apply()
+        line2 = self.my_converter.update_farenheits(LineEdits('Preheat oven till 350'), components2.quantities[0],
+                                                    components2).apply()
 
         self.assertEqual(line1, 'Preheat oven till 177 °C. ')
         self.assertEqual(line2, 'Preheat oven till 177 °C.')
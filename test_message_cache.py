@@ -0,0 +1,77 @@
+import unittest
+
+from message_cache import MessageCache
+
+
+class TestMessageCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.converted = []
+        self.sent = []
+        self.edited = []
+
+    def answer_lines(self, lines):
+        self.converted.append(lines)
+        return [line.upper() for line in lines]
+
+    def send(self, chat_id, text):
+        self.sent.append((chat_id, text))
+        return 100 + len(self.sent)
+
+    def edit(self, chat_id, reply_id, text):
+        self.edited.append((chat_id, reply_id, text))
+
+    def test_edited_message(self):
+        cache = MessageCache()
+
+        answer = cache.reply(1, 10, '1 cup milk\nMix well\n1 cup milk', self.answer_lines, self.send, self.edit)
+        self.assertEqual(answer, '1 CUP MILK\nMIX WELL\n1 CUP MILK')
+        self.assertEqual(self.sent, [(1, '1 CUP MILK\nMIX WELL\n1 CUP MILK')])
+
+        answer = cache.reply(1, 10, '1 cup milk\nMix well!\n1 cup milk', self.answer_lines, self.send, self.edit)
+        self.assertEqual(answer, '1 CUP MILK\nMIX WELL!\n1 CUP MILK')
+        self.assertEqual(self.converted, [['1 cup milk', 'Mix well'], ['Mix well!']])
+        self.assertEqual(self.edited, [(1, 101, '1 CUP MILK\nMIX WELL!\n1 CUP MILK')])
+        self.assertEqual(list(cache.get(1, 10).lines), ['1 cup milk', 'Mix well!'])
+        self.assertEqual((cache.converted, cache.reused), (3, 1))
+
+        # Nothing changed - the reply is not edited again
+        cache.reply(1, 10, '1 cup milk\nMix well!\n1 cup milk', self.answer_lines, self.send, self.edit)
+        self.assertEqual(len(self.converted), 2)
+        self.assertEqual(len(self.edited), 1)
+
+        # Another chat with the same message id is another message
+        cache.reply(2, 10, '1 cup milk', self.answer_lines, self.send, self.edit)
+        self.assertEqual(self.sent[-1], (2, '1 CUP MILK'))
+
+    def test_size(self):
+        cache = MessageCache(size=2)
+
+        for message_id in range(3):
+            cache.reply(1, message_id, 'line {}'.format(message_id), self.answer_lines, self.send, self.edit)
+        cache.reply(1, 0, 'line 0', self.answer_lines, self.send, self.edit)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(1, 1))
+        self.assertEqual(len(self.sent), 4)
+        self.assertEqual(self.edited, [])
+
+    def test_evicted_while_answering(self):
+        cache = MessageCache(size=1)
+        cache.reply(1, 10, 'a\nb', self.answer_lines, self.send, self.edit)
+
+        def answer_lines(lines):
+            # Another message deletes the edited one from the cache while its lines are answered
+            cache.put(1, 11, ['x'], {'x': 'X'})
+            return self.answer_lines(lines)
+
+        answer = cache.reply(1, 10, 'a\nc', answer_lines, self.send, self.edit)
+
+        self.assertEqual(answer, 'A\nC')
+        self.assertEqual(self.converted, [['a', 'b'], ['c'], ['a']])
+        self.assertEqual(self.edited, [(1, 101, 'A\nC')])
+        self.assertEqual(cache.get(1, 10).lines, {'a': 'A', 'c': 'C'})
+        self.assertEqual(cache.get(1, 10).reply_id, 101)
+
+
+unittest.main()
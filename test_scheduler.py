@@ -0,0 +1,113 @@
+import time
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import ChatScheduler
+
+
+class TestChatScheduler(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.handled = []
+        self.rejected = []
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+
+    def handle(self, chat_id, item):
+        self.release.wait(5)
+        with self.lock:
+            self.handled.append((chat_id, item))
+
+    def reject(self, chat_id, item):
+        self.rejected.append((chat_id, item))
+
+    def test_round_robin(self):
+        scheduler = ChatScheduler(self.handle, workers=1, chat_size=10, reject=self.reject).start()
+
+        # The worker is busy with the first message, the rest wait in the queues
+        scheduler.submit('a', 0)
+        time.sleep(0.05)
+        for i in range(1, 4):
+            scheduler.submit('a', i)
+        scheduler.submit('b', 0)
+        scheduler.submit('c', 0)
+
+        self.assertEqual(scheduler.stats()['queued'], 5)
+        self.assertEqual(scheduler.stats()['max_chat_queue'], 3)
+
+        self.release.set()
+        scheduler.stop()
+
+        self.assertEqual(self.handled, [('a', 0), ('b', 0), ('c', 0), ('a', 1), ('a', 2), ('a', 3)])
+        self.assertEqual(scheduler.stats()['processed'], 6)
+
+    def test_overload(self):
+        scheduler = ChatScheduler(self.handle, workers=2, chat_size=2, total_size=3, reject=self.reject).start()
+
+        accepted = [scheduler.submit('a', i) for i in range(4)] + [scheduler.submit('b', 0),
+                                                                  scheduler.submit('c', 0)]
+        self.release.set()
+        scheduler.stop()
+
+        stats = scheduler.stats()
+        self.assertEqual(accepted.count(False), len(self.rejected))
+        self.assertEqual(sorted(self.handled + self.rejected), sorted(('a', i) for i in range(4)) +
+                         [('b', 0), ('c', 0)])
+        self.assertEqual((stats['submitted'], stats['rejected']), (len(self.handled), len(self.rejected)))
+        self.assertFalse(scheduler.submit('a', 5))
+
+    def test_metrics(self):
+        scheduler = ChatScheduler(lambda chat_id, item: 1 / item, workers=2).start()
+
+        with self.assertLogs('scheduler', 'ERROR'):
+            for i in range(5):
+                scheduler.submit(i % 2, i)
+            scheduler.stop()
+
+        stats = scheduler.stats()
+        self.assertEqual((stats['processed'], stats['failed'], stats['queued']), (5, 1, 0))
+        self.assertTrue(stats['wait_p50'] <= stats['wait_p99'] <= stats['wait_max'])
+
+        text = scheduler.export_metrics()
+        self.assertIn('bot_scheduler_processed_total 5', text)
+        self.assertIn('bot_scheduler_wait_seconds_count 5', text)
+        self.assertIn('# TYPE bot_scheduler_queued gauge', text)
+
+    def test_futures(self):
+        executor = ThreadPoolExecutor(4)
+
+        def handle(chat_id, item):
+            return executor.submit(self.handle, chat_id, item)
+
+        scheduler = ChatScheduler(handle, workers=1).start()
+
+        # One worker starts messages of several chats without waiting for them
+        for chat_id in 'abc':
+            scheduler.submit(chat_id, 0)
+            scheduler.submit(chat_id, 1)
+        time.sleep(0.05)
+        self.assertEqual(scheduler.stats()['active'], 3)
+        self.assertEqual(scheduler.stats()['queued'], 3)
+
+        self.release.set()
+        scheduler.stop()
+        executor.shutdown()
+
+        self.assertEqual(sorted(self.handled), [(chat_id, i) for chat_id in 'abc' for i in range(2)])
+        self.assertEqual([item for chat_id, item in self.handled if chat_id == 'a'], [0, 1])
+        self.assertEqual(scheduler.stats()['processed'], 6)
+
+        executor = ThreadPoolExecutor(1)
+        failing = ChatScheduler(lambda chat_id, item: executor.submit(lambda: 1 / item), workers=1)
+        with self.assertLogs('scheduler', 'ERROR'):
+            failing.start()
+            failing.submit('a', 0)
+            failing.submit('a', 1)
+            failing.stop()
+        executor.shutdown()
+
+        self.assertEqual((failing.stats()['processed'], failing.stats()['failed']), (2, 1))
+
+
+unittest.main()
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from translation import BaseTranslator, OfflineTranslator, TranslationCache, CachedTranslator
+
+
+class TestCachedTranslator(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'translations.sqlite3')
+        self.translator = OfflineTranslator()
+        self.cache = TranslationCache(self.path, max_size=3)
+        self.cached_translator = CachedTranslator(self.translator, self.cache)
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def test_translate_misses_only(self):
+        text1 = self.cached_translator.translate('1 tsp  salt\n\nMix well\n1 tsp salt', dest='ru')
+        text2 = self.cached_translator.translate('Mix well\n 1 tsp salt', dest='ru')
+
+        self.assertEqual(text1, '[ru] 1 tsp salt\n\n[ru] Mix well\n[ru] 1 tsp salt')
+        self.assertEqual(text2, '[ru] Mix well\n[ru] 1 tsp salt')
+        self.assertEqual((self.translator.calls, self.translator.lines), (1, 2))
+
+        self.cached_translator.translate('Mix well', dest='de')
+        self.assertEqual((self.translator.calls, self.translator.lines), (2, 3))
+
+    def test_eviction_and_persistence(self):
+        self.cached_translator.translate('a\nb\nc', dest='ru')
+        self.cached_translator.translate('a', dest='ru')
+        self.cached_translator.translate('d', dest='ru')
+        self.assertEqual(self.cache.size(), 3)
+
+        cache = TranslationCache(self.path, max_size=3)
+        self.assertEqual(sorted(cache.get_many(['a', 'b', 'c', 'd'], 'ru')), ['a', 'c', 'd'])
+        cache.close()
+
+    def test_base_translator(self):
+        with self.assertRaises(TypeError):
+            BaseTranslator()
+
+
+unittest.main()
@@ -0,0 +1,231 @@
+import json
+import time
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from converter import ARConverter
+from message_cache import MessageCache
+from scheduler import ChatScheduler
+from webhook import parse_update, Message, TelegramClient, TelegramError, WebhookServer, SECRET_HEADER
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        params = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        result = self.server.call(self.path, method, params)
+
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(200 if result['ok'] else 400)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegramAPI(ThreadingHTTPServer):
+    """Local Telegram Bot API - records sent and edited messages and posts updates to the webhook"""
+
+    daemon_threads = True
+
+    def __init__(self, token):
+        super().__init__(('127.0.0.1', 0), FakeTelegramHandler)
+        self.token = token
+        self.calls = []
+        self.last_id = 1000
+        self.update_id = 0
+        self.lock = threading.Lock()
+        self.replied = threading.Condition(self.lock)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def call(self, path, method, params):
+        with self.lock:
+            if not path.startswith('/bot{}/'.format(self.token)):
+                return {'ok': False, 'description': 'Unauthorized'}
+
+            if method == 'sendMessage':
+                self.last_id += 1
+                result = {'message_id': self.last_id, 'chat': {'id': params['chat_id']}, 'text': params['text']}
+            elif method == 'editMessageText':
+                result = True
+            else:
+                return {'ok': False, 'description': 'Unknown method'}
+
+            self.calls.append((method, params))
+            self.replied.notify_all()
+            return {'ok': True, 'result': result}
+
+    def wait_calls(self, number, timeout=5):
+        with self.lock:
+            self.replied.wait_for(lambda: len(self.calls) >= number, timeout)
+            return list(self.calls)
+
+    def post_update(self, webhook_url, chat_id, message_id, text, edited=False, secret=None, update_id=None):
+        if update_id is None:
+            self.update_id += 1
+            update_id = self.update_id
+
+        update = {'update_id': update_id,
+                  'edited_message' if edited else 'message': {'message_id': message_id, 'chat': {'id': chat_id},
+                                                              'text': text}}
+        return post(webhook_url, update, secret)
+
+
+def post(url, data, secret=None):
+    """Post JSON and return the HTTP status"""
+
+    headers = {'Content-Type': 'application/json'}
+    if secret is not None:
+        headers[SECRET_HEADER] = secret
+
+    request = urllib.request.Request(url, data=json.dumps(data).encode('utf-8'), headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+class TestParseUpdate(unittest.TestCase):
+
+    def test_messages(self):
+        message = {'message_id': 7, 'chat': {'id': 42}, 'text': '1 cup sugar'}
+
+        self.assertEqual(parse_update({'update_id': 1, 'message': message}), Message(42, 7, '1 cup sugar', False))
+        self.assertEqual(parse_update({'update_id': 1, 'edited_message': message}),
+                         Message(42, 7, '1 cup sugar', True))
+
+        # Not text messages and other updates are skipped
+        self.assertIsNone(parse_update({'update_id': 1, 'message': {'message_id': 7, 'chat': {'id': 42}}}))
+        self.assertIsNone(parse_update({'update_id': 1, 'callback_query': {}}))
+
+    def test_malformed(self):
+        for update in [[], {}, {'update_id': '1'}, {'update_id': 1, 'message': 'text'},
+                       {'update_id': 1, 'message': {'message_id': 7, 'text': 'text'}},
+                       {'update_id': 1, 'message': {'chat': {'id': 42}, 'text': 'text'}}]:
+            with self.assertRaises(ValueError):
+                parse_update(update)
+
+
+class TestWebhook(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.api = FakeTelegramAPI('TOKEN')
+        self.telegram = TelegramClient('TOKEN', self.api.url)
+        self.converter = ARConverter()
+        self.converter_lock = threading.Lock()
+        self.message_cache = MessageCache()
+
+        # The same wiring as in the bot: update -> scheduler -> message cache -> converter -> Telegram API
+        self.scheduler = ChatScheduler(self.answer_message, workers=4).start()
+        self.server = WebhookServer(lambda message: self.scheduler.submit(message.chat_id, message),
+                                    secret_token='secret', port=0, metrics=self.export_metrics).start()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.scheduler.stop()
+        self.api.shutdown()
+        self.api.server_close()
+
+    def export_metrics(self):
+        return self.scheduler.export_metrics() + self.converter.export_metrics()
+
+    def answer_lines(self, lines):
+        with self.converter_lock:
+            return self.converter.process_text('\n'.join(lines)).split('\n')
+
+    def answer_message(self, chat_id, message):
+        self.message_cache.reply(chat_id, message.message_id, message.text, self.answer_lines,
+                                 self.telegram.send_message, self.telegram.edit_message_text)
+
+    def wait_processed(self, number, timeout=5):
+        # Replies are saved in the message cache after they are sent - wait for the workers, not for the API
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stats = self.scheduler.stats()
+            if stats['processed'] >= number and stats['active'] == 0:
+                return
+            time.sleep(0.01)
+
+    def test_end_to_end(self):
+        texts = ['1 cup sugar\n2 tbsp butter', 'Preheat oven to 350°F', '8 oz cream cheese']
+        for chat_id, text in enumerate(texts):
+            self.assertEqual(self.api.post_update(self.server.url, chat_id, 1, text, secret='secret'), 200)
+
+        calls = self.api.wait_calls(3)
+        self.assertEqual(sorted((params['chat_id'], params['text']) for method, params in calls),
+                         [(chat_id, self.converter.process_text(text)) for chat_id, text in enumerate(texts)])
+
+        # The edited message gets its reply edited
+        self.wait_processed(3)
+        reply_id = self.message_cache.get(0, 1).reply_id
+        self.assertEqual(self.api.post_update(self.server.url, 0, 1, '2 cups sugar\n2 tbsp butter', edited=True,
+                                              secret='secret'), 200)
+
+        method, params = self.api.wait_calls(4)[-1]
+        self.assertIsNotNone(reply_id)
+        self.assertEqual((method, params['message_id']), ('editMessageText', reply_id))
+        self.assertEqual(params['text'], self.converter.process_text('2 cups sugar\n2 tbsp butter'))
+
+    def test_concurrent_updates(self):
+        threads = [threading.Thread(target=self.api.post_update,
+                                    args=(self.server.url, chat_id, 1, '{} cups flour'.format(chat_id + 1)),
+                                    kwargs={'secret': 'secret'}) for chat_id in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        calls = self.api.wait_calls(20)
+        self.assertEqual(sorted(params['chat_id'] for method, params in calls), list(range(20)))
+
+    def test_validation(self):
+        message = {'message_id': 1, 'chat': {'id': 1}, 'text': '1 cup sugar'}
+
+        self.assertEqual(post(self.server.url, {'update_id': 1, 'message': message}), 403)
+        self.assertEqual(post(self.server.url, {'update_id': 1, 'message': message}, 'wrong'), 403)
+        self.assertEqual(post(self.server.url + '/other', {'update_id': 1, 'message': message}, 'secret'), 404)
+        self.assertEqual(post(self.server.url, {'message': message}, 'secret'), 400)
+        self.assertEqual(post(self.server.url, {'update_id': 1, 'message': message}, 'secret'), 200)
+
+        # Telegram repeats the update - it's answered only once
+        self.assertEqual(post(self.server.url, {'update_id': 1, 'message': message}, 'secret'), 200)
+        self.scheduler.stop()
+        self.assertEqual(len(self.api.calls), 1)
+
+    def test_metrics(self):
+        self.assertEqual(self.api.post_update(self.server.url, 1, 1, '1 cup sugar', secret='secret'), 200)
+        self.api.wait_calls(1)
+        self.wait_processed(1)
+
+        metrics_url = self.server.url.replace('/webhook', '/metrics')
+        with urllib.request.urlopen(metrics_url, timeout=5) as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+            text = response.read().decode('utf-8')
+
+        self.assertIn('bot_scheduler_processed_total 1', text)
+        self.assertIn('bot_scheduler_queued 0', text)
+        self.assertIn('arconverter_lines_total{class="convert"} 1', text)
+
+        for url, code in [(self.server.url, 405), (metrics_url + '/other', 404)]:
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url, timeout=5)
+            self.assertEqual(error.exception.code, code)
+
+    def test_telegram_error(self):
+        with self.assertRaises(TelegramError):
+            TelegramClient('WRONG', self.api.url).send_message(1, 'text')
+
+
+unittest.main()
@@ -0,0 +1,143 @@
+"""
+Translators for the bot and a persistent cache of translations.
+Recipes repeat a lot - the same lines ('1/2 tsp salt', 'Preheat oven to 180 °C.') are translated again and again,
+so every line is translated only once for every target language and kept in a SQLite file.
+Only lines missing in the cache go to the translator.
+"""
+
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+
+class BaseTranslator(ABC):
+    """Interface of translators - translate a list of lines at once"""
+
+    @abstractmethod
+    def translate_lines(self, lines, dest):
+        """Return translations of the lines to the dest language, one for every line"""
+
+
+class GoogleTranslator(BaseTranslator):
+    """Translates lines with googletrans in one request - lines are joined with line breaks.
+    If the answer has another number of lines, every line is translated separately"""
+
+    def __init__(self, translator):
+        self.translator = translator
+
+    def translate_lines(self, lines, dest):
+        result = self.translator.translate('\n'.join(lines), dest=dest).text.split('\n')
+
+        if len(result) != len(lines):
+            result = [self.translator.translate(line, dest=dest).text for line in lines]
+
+        return result
+
+
+class OfflineTranslator(BaseTranslator):
+    """Stand-in translator without network access for tests and benchmarks -
+    marks every line with the target language and counts translated lines"""
+
+    def __init__(self):
+        self.calls = 0
+        self.lines = 0
+
+    def translate_lines(self, lines, dest):
+        self.calls += 1
+        self.lines += len(lines)
+
+        return ['[{}] {}'.format(dest, line) for line in lines]
+
+
+class TranslationCache:
+    """Translations of lines in a SQLite file: (target language, normalized line) -> translation.
+    Keeps up to max_size lines - the least recently used lines are deleted first"""
+
+    def __init__(self, path, max_size=100000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS translations (dest TEXT, line TEXT, translation TEXT, '
+                                'used INTEGER, PRIMARY KEY (dest, line))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS translations_used ON translations (used)')
+        self.connection.commit()
+
+        self.counter = self.connection.execute('SELECT COALESCE(MAX(used), 0) FROM translations').fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, lines, dest):
+        """Return dictionary line -> translation for lines which are in the cache"""
+
+        result = {}
+
+        with self.lock:
+            for line in set(lines):
+                row = self.connection.execute('SELECT translation FROM translations WHERE dest = ? AND line = ?',
+                                              (dest, line)).fetchone()
+                if row:
+                    result[line] = row[0]
+
+            self.hits += len(result)
+            self.misses += len(set(lines)) - len(result)
+
+            if result:
+                self.counter += 1
+                self.connection.executemany('UPDATE translations SET used = ? WHERE dest = ? AND line = ?',
+                                            [(self.counter, dest, line) for line in result])
+                self.connection.commit()
+
+        return result
+
+    def put_many(self, translations, dest):
+        """Save dictionary line -> translation and delete the least recently used lines if there are too many"""
+
+        with self.lock:
+            self.counter += 1
+            self.connection.executemany('INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)',
+                                        [(dest, line, translation, self.counter)
+                                         for line, translation in translations.items()])
+
+            size = self.connection.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+            if size > self.max_size:
+                self.connection.execute('DELETE FROM translations WHERE rowid IN '
+                                        '(SELECT rowid FROM translations ORDER BY used, rowid LIMIT ?)',
+                                        (size - self.max_size,))
+            self.connection.commit()
+
+    def size(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class CachedTranslator:
+    """Translates text line by line through the cache - only lines missing in the cache go to the translator.
+    Lines are normalized (extra spaces are deleted) before looking them up"""
+
+    def __init__(self, translator, cache):
+        self.translator = translator
+        self.cache = cache
+
+    def translate(self, text, dest='ru'):
+        lines = [self.normalize(line) for line in text.split('\n')]
+        to_translate = [line for line in lines if line]
+
+        translations = self.cache.get_many(to_translate, dest)
+        misses = list(dict.fromkeys(line for line in to_translate if line not in translations))
+
+        if misses:
+            translated = dict(zip(misses, self.translator.translate_lines(misses, dest)))
+            self.cache.put_many(translated, dest)
+            translations.update(translated)
+
+        return '\n'.join(translations[line] if line else '' for line in lines)
+
+    @staticmethod
+    def normalize(line):
+        return ' '.join(line.split())
@@ -0,0 +1,212 @@
+"""
+Webhook mode of the bot. Telegram posts updates to a small HTTP server instead of the bot polling for them.
+Updates are validated and handed to the same pipeline as in the polling mode, answers are sent through
+Telegram Bot API. Requests are handled concurrently, and several processes could serve the same port
+(reuse_port) or run behind a load balancer - messages of one chat should go to the same process then,
+otherwise edits of a message are answered with a new reply.
+"""
+
+import hmac
+import json
+import socket
+import logging
+import threading
+import urllib.error
+import urllib.request
+from collections import namedtuple, OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+logger = logging.getLogger(__name__)
+
+# A text message (or its new version) from a Telegram update
+Message = namedtuple('Message', ['chat_id', 'message_id', 'text', 'edited'])
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def parse_update(update):
+    """Return Message from a Telegram update, None for updates without text messages.
+    Raise ValueError if the update is malformed"""
+
+    if not isinstance(update, dict) or not isinstance(update.get('update_id'), int):
+        raise ValueError('update_id is missing')
+
+    for key, edited in [('message', False), ('edited_message', True)]:
+        message = update.get(key)
+        if message is None:
+            continue
+
+        if not isinstance(message, dict) or not isinstance(message.get('chat'), dict):
+            raise ValueError('{} is malformed'.format(key))
+
+        chat_id = message['chat'].get('id')
+        message_id = message.get('message_id')
+        if not isinstance(chat_id, int) or not isinstance(message_id, int):
+            raise ValueError('{} has no chat id or message id'.format(key))
+
+        if not isinstance(message.get('text'), str):
+            return None
+
+        return Message(chat_id, message_id, message['text'], edited)
+
+    return None
+
+
+class TelegramError(Exception):
+    pass
+
+
+class TelegramClient:
+    """Minimal client of Telegram Bot API - sends and edits messages and sets the webhook.
+    base_url could point to a local fake API in tests"""
+
+    def __init__(self, token, base_url='https://api.telegram.org', timeout=10):
+        self.url = '{}/bot{}/'.format(base_url.rstrip('/'), token)
+        self.timeout = timeout
+
+    def call(self, method, **params):
+        request = urllib.request.Request(self.url + method, data=json.dumps(params).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as error:
+            result = json.loads(error.read().decode('utf-8') or '{}')
+
+        if not result.get('ok'):
+            raise TelegramError('{} failed: {}'.format(method, result.get('description')))
+
+        return result.get('result')
+
+    def send_message(self, chat_id, text):
+        """Send a message and return its id"""
+
+        return self.call('sendMessage', chat_id=chat_id, text=text)['message_id']
+
+    def edit_message_text(self, chat_id, message_id, text):
+        self.call('editMessageText', chat_id=chat_id, message_id=message_id, text=text)
+
+    def set_webhook(self, url, secret_token=None):
+        params = {'url': url, 'allowed_updates': ['message', 'edited_message']}
+        if secret_token:
+            params['secret_token'] = secret_token
+
+        return self.call('setWebhook', **params)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+
+        if self.path != server.path:
+            return self.answer(404)
+
+        if server.secret_token and not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), server.secret_token):
+            return self.answer(403)
+
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            return self.answer(411)
+        if int(length) > server.max_body:
+            return self.answer(413)
+
+        try:
+            update = json.loads(self.rfile.read(int(length)).decode('utf-8'))
+            message = parse_update(update)
+        except ValueError as error:
+            return self.answer(400, str(error))
+
+        # Telegram sends an update again if it didn't get an answer in time
+        if message is not None and server.is_new_update(update['update_id']):
+            server.on_message(message)
+
+        return self.answer(200)
+
+    def do_GET(self):
+        server = self.server
+
+        if server.metrics is None or self.path != server.metrics_path:
+            return self.answer(405 if self.path == server.path else 404)
+
+        body = server.metrics().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, code, description=''):
+        body = json.dumps({'ok': code == 200, 'description': description}).encode('utf-8')
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """HTTP server for Telegram updates - on_message(Message) is called for every new text message
+    in the thread of the request, so it should only put the message in a queue (ChatScheduler.submit).
+    metrics() returns metrics in Prometheus text exposition format, they are served on GET metrics_path"""
+
+    daemon_threads = True
+
+    def __init__(self, on_message, path='/webhook', secret_token=None, host='127.0.0.1', port=8443,
+                 reuse_port=False, max_body=1024 * 1024, recent_updates=10000, metrics=None, metrics_path='/metrics'):
+        self.on_message = on_message
+        self.path = path
+        self.metrics = metrics
+        self.metrics_path = metrics_path
+        self.secret_token = secret_token
+        self.reuse_port = reuse_port
+        self.max_body = max_body
+
+        self.recent_updates = OrderedDict()
+        self.recent_size = recent_updates
+        self.lock = threading.Lock()
+        self.thread = None
+
+        super().__init__((host, port), WebhookHandler)
+
+    def server_bind(self):
+        # Several processes could listen to the same port, the kernel balances connections between them
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, self.path)
+
+    def is_new_update(self, update_id):
+        with self.lock:
+            if update_id in self.recent_updates:
+                return False
+
+            self.recent_updates[update_id] = True
+            if len(self.recent_updates) > self.recent_size:
+                self.recent_updates.popitem(last=False)
+
+            return True
+
+    def start(self):
+        """Serve in a background thread"""
+
+        self.thread = threading.Thread(target=self.serve_forever, name='WebhookServer', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()